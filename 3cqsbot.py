@@ -3,28 +3,41 @@ import asyncio
 import json
 import math
 import os
+import random
 import re
+import socket
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from time import time
+from time import process_time, time
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
-import numpy as np
 import portalocker
+import py3cw.request
 import requests
-import yfinance as yf
 from babel.dates import format_timedelta
 from babel.numbers import format_currency
-from numpy import true_divide
 from py3cw.request import Py3CW
-from telethon import TelegramClient, events
-from tenacity import retry, wait_fixed
+from telethon import events
 
 from config import Config
+from dca import funds_needed
+from lease import Lease
 from logger import Logger, NotificationHandler
+from loopmonitor import loop_monitor
 from multibot import MultiBot
+from resilience import SWITCH, UPDATE, GuardedPy3CW, RequestBudget, endpoint
+from resilience import metrics as api_metrics
 from signals import Signals
+from signalqueue import SignalQueue
 from singlebot import SingleBot
+from state import BotState
+from tgclient import CatchUpClient
 
 ######################################################
 #                       Config                       #
@@ -32,15 +45,23 @@ from singlebot import SingleBot
 
 program = Path(__file__).stem
 
-# Parse and interpret options
-parser = argparse.ArgumentParser(description="3CQSBot bringing 3CQS signals to 3Commas")
+# Set by tenants.py when several bot configurations run in one process
+TENANT = globals().get("TENANT")
 
-parser.add_argument("-d", "--datadir", help="data directory to use", type=str)
-args = parser.parse_args()
-if args.datadir:
-    datadir = args.datadir
+# Parse and interpret options
+if TENANT:
+    datadir = TENANT["datadir"]
 else:
-    datadir = os.getcwd()
+    parser = argparse.ArgumentParser(
+        description="3CQSBot bringing 3CQS signals to 3Commas"
+    )
+
+    parser.add_argument("-d", "--datadir", help="data directory to use", type=str)
+    args = parser.parse_args()
+    if args.datadir:
+        datadir = args.datadir
+    else:
+        datadir = os.getcwd()
 
 # load configuration file
 attributes = Config(datadir, program)
@@ -65,6 +86,7 @@ logging = Logger(
     attributes.get("logrotate", 7),
     attributes.get("debug", False),
     attributes.get("notifications", False),
+    TENANT["name"] if TENANT else None,
 )
 
 logging.info(f"Loaded configuration from '{datadir}/{program}.ini' or config.ini")
@@ -74,57 +96,41 @@ logging.info(f"Loaded configuration from '{datadir}/{program}.ini' or config.ini
 ######################################################
 
 # Initialize 3Commas API client
-p3cw = Py3CW(
-    key=attributes.get("key"),
-    secret=attributes.get("secret"),
-    request_options={
-        "request_timeout": attributes.get("timeout", 3),
-        "nr_of_retries": attributes.get("retries", 5),
-        "retry_backoff_factor": attributes.get("delay_between_retries", 2.0),
-    },
+# api_url can point to a local stand-in server (commas_stub.py) for load and latency tests
+py3cw.request.API_URL = attributes.get("api_url", "https://api.3commas.io")
+# Timeout adapts to the latency of 3commas up to the configured timeout,
+# requests are prioritised within the rate limit: deal starts > enable/disable > updates > reporting
+p3cw = GuardedPy3CW(
+    Py3CW(
+        key=attributes.get("key"),
+        secret=attributes.get("secret"),
+        request_options={
+            "request_timeout": attributes.get("timeout", 3),
+            "nr_of_retries": attributes.get("retries", 5),
+            "retry_backoff_factor": attributes.get("delay_between_retries", 2.0),
+        },
+    ),
+    # one breaker per account, the bots of tenants.py do not share it
+    endpoint(
+        "3commas " + TENANT["name"] if TENANT else "3commas",
+        timeout=attributes.get("timeout", 3),
+        max_timeout=attributes.get("timeout", 3),
+    ),
+    RequestBudget(attributes.get("rate_limit", 120)),
 )
 
-# Initialize Telegram API client
-client = TelegramClient(
-    attributes.get("sessionfile", "tgsesssion"),
-    attributes.get("api_id"),
-    attributes.get("api_hash"),
-)
+# Initialize Telegram API client, shared by all bots of the process in tenant mode
+if TENANT:
+    client = TENANT["client"]
+else:
+    client = CatchUpClient(
+        attributes.get("sessionfile", "tgsesssion"),
+        attributes.get("api_id"),
+        attributes.get("api_hash"),
+    )
 
 # Initialize global variables
-asyncState = type("", (), {})()
-asyncState.bot_active = True
-asyncState.first_topcoin_call = True
-asyncState.fgi = -1
-asyncState.fgi_downtrend = False
-asyncState.fgi_drop = False
-asyncState.fgi_allows_trading = True
-asyncState.fgi_time_until_update = 1
-asyncState.dca_conf = "dcabot"
-asyncState.chatid = ""
-asyncState.fh = 0
-asyncState.account_data = {}
-asyncState.pair_data = []
-asyncState.symrank_success = False
-asyncState.symrank_retry = 60
-asyncState.multibot = {}
-asyncState.pairs_volume = []
-asyncState.receive_signals = (
-    False  # start processing 3cqs signals after async routines are working
-)
-asyncState.start_time = 0
-asyncState.start_signals_24h = 0
-asyncState.start_signals = 0
-asyncState.start_signals_bot_enabled_24h = 0
-asyncState.start_signals_bot_enabled = 0
-asyncState.start_signals_not_tradeable_24h = 0
-asyncState.start_signals_not_tradeable = 0
-asyncState.start_signals_symrank_filter_passed_24h = 0
-asyncState.start_signals_symrank_filter_passed = 0
-asyncState.start_signals_topcoin_filter_passed_24h = 0
-asyncState.start_signals_topcoin_filter_passed = 0
-asyncState.stop_signals_24h = 0
-asyncState.stop_signals = 0
+asyncState = BotState()
 
 ######################################################
 #                     Methods                        #
@@ -132,7 +138,8 @@ asyncState.stop_signals = 0
 
 
 def single_instance_check():
-    asyncState.fh = open(os.path.realpath(__file__), "r")
+    # One bot per data directory, several bots can run from one installation
+    asyncState.fh = open(os.path.join(datadir, program + ".lock"), "a")
     try:
         portalocker.lock(asyncState.fh, portalocker.LOCK_EX | portalocker.LOCK_NB)
     except:
@@ -285,13 +292,28 @@ def account_data():
     return account
 
 
+def list_attribute(attribute):
+    # list options like token_denylist = [USDT_BUSD, USDT_USDC] are read as plain string
+    value = attributes.get(attribute, [])
+    if isinstance(value, str):
+        value = [item.strip(" '\"") for item in value.strip("[]").split(",")]
+    return frozenset(item for item in value if item)
+
+
+def diff_pairs(previous, pairs, blacklist):
+    # Changes of the tradeable pair index compared to the last refresh
+    added = pairs - previous
+    removed = previous - pairs
+    blacklisted = removed & blacklist
+    return added, removed - blacklisted, blacklisted
+
+
 async def pair_data(account, interval_sec):
     more_inform = attributes.get("extensive_notifications", False)
+    denylist = list_attribute("token_denylist")
+    retry_sec = 10
     while True:
         try:
-            pairs = []
-            asyncState.pair_data = []
-
             error, data = p3cw.request(
                 entity="accounts",
                 action="market_pairs",
@@ -299,6 +321,12 @@ async def pair_data(account, interval_sec):
                 payload={"market_code": account["market_code"]},
             )
 
+            # rate limited, keep the current pairs and retry soon
+            if error and error.get("status_code") == 429:
+                logging.info("function pair_data: " + error["msg"] + " - retry in 60s")
+                await asyncio.sleep(60)
+                continue
+
             if error:
                 logging.error("function pair_data: " + error["msg"])
                 sys.tracebacklimit = 0
@@ -308,6 +336,11 @@ async def pair_data(account, interval_sec):
                 entity="bots", action="pairs_black_list"
             )
 
+            if error and error.get("status_code") == 429:
+                logging.info("function pair_data: " + error["msg"] + " - retry in 60s")
+                await asyncio.sleep(60)
+                continue
+
             if error:
                 logging.error("function pair_data: " + error["msg"])
                 sys.tracebacklimit = 0
@@ -315,15 +348,18 @@ async def pair_data(account, interval_sec):
                     "Problem fetching pairs blacklist data from 3commas api - stopping!"
                 )
 
-            for pair in data:
-                if attributes.get("market") in pair:
-                    if (
-                        pair not in attributes.get("token_denylist", [])
-                        and pair not in blacklist_data["pairs"]
-                    ):
-                        pairs.append(pair)
+            blacklist = frozenset(blacklist_data["pairs"]) | denylist
+            pairs = frozenset(
+                pair
+                for pair in data
+                if attributes.get("market") in pair and pair not in blacklist
+            )
 
+            # swap the whole index at once, signals never see an empty or partial pair list
+            previous = asyncState.pair_data
             asyncState.pair_data = pairs
+            ready("pair_data").set()
+
             logging.info(
                 str(len(pairs))
                 + " tradeable and non-blacklisted "
@@ -336,25 +372,105 @@ async def pair_data(account, interval_sec):
                 + format_timedelta(interval_sec, locale="en_US"),
                 more_inform,
             )
+            if previous:
+                added, removed, blacklisted = diff_pairs(previous, pairs, blacklist)
+                if added or removed or blacklisted:
+                    logging.info(
+                        "Tradeable pairs changed - added: "
+                        + str(sorted(added))
+                        + " - removed: "
+                        + str(sorted(removed))
+                        + " - blacklisted: "
+                        + str(sorted(blacklisted)),
+                        more_inform,
+                    )
+                else:
+                    logging.debug("Tradeable pairs unchanged since last update")
             notification.send_notification()
             await asyncio.sleep(interval_sec)
         except Exception as err:
             logging.error(f"Exception raised by async pair_data: {err}")
+            if ready("pair_data").is_set():
+                await asyncio.sleep(interval_sec)
+            else:
+                # startup waits for the first pairs, retry with a growing delay
+                logging.error(f"pair_data: Retrying in {retry_sec}sec")
+                await asyncio.sleep(retry_sec)
+                retry_sec = min(retry_sec * 2, 600)
+
+
+async def topcoin_decisions(interval_sec):
+    # Pre-evaluate the topcoin filter for all tradeable pairs, START signals look the decision up
+    signals = Signals(logging)
+    while True:
+        try:
+            settings = (
+                attributes.get("topcoin_limit", 3500, asyncState.dca_conf),
+                attributes.get("topcoin_volume", 0, asyncState.dca_conf),
+                attributes.get("topcoin_exchange", "binance"),
+                attributes.get("market"),
+            )
+            prefix = attributes.get("market") + "_"
+            # CoinGecko is called in a thread, the loop keeps serving signals
+            index = await asyncio.to_thread(signals.market_index, settings[0])
+            started = time()
+            passed = 0
+            for pair in sorted(asyncState.pair_data):
+                if not pair.startswith(prefix):
+                    continue
+                misses = Signals.cgexchanges.cache_info().misses
+                try:
+                    decision = await asyncio.to_thread(
+                        signals.topcoin_decision, pair[len(prefix) :], index, *settings
+                    )
+                except IOError as err:
+                    # failed volume checks are no decisions, retry with the next run
+                    logging.error(
+                        "topcoin_decisions: CoinGecko not available, stopped at "
+                        + pair
+                        + ": "
+                        + str(err)
+                    )
+                    break
+                asyncState.topcoin_table.update(pair, settings, *decision)
+                passed += decision[0]
+                # avoid being blocked by CG for too many API requests, cached coins need no pause
+                if Signals.cgexchanges.cache_info().misses > misses:
+                    await asyncio.sleep(2.2)
+                else:
+                    await asyncio.sleep(0)
+
+            logging.info(
+                "Topcoin filter pre-evaluated for "
+                + str(len(asyncState.topcoin_table))
+                + " pairs in "
+                + format_timedelta(time() - started, locale="en_US")
+                + " - "
+                + str(passed)
+                + " passing. Next update in approx. "
+                + format_timedelta(interval_sec, locale="en_US"),
+                attributes.get("extensive_notifications", False),
+            )
+            await asyncio.sleep(interval_sec)
+        except Exception as err:
+            logging.error(f"Exception raised by async topcoin_decisions: {err}")
+            logging.error(f"topcoin_decisions: Sleeping for {interval_sec}sec")
             await asyncio.sleep(interval_sec)
 
 
 # Credits go to @M1ch43l
 # Adjust DCA settings dynamically according to social sentiment: greed = aggressive DCA, neutral = moderate DCA, fear = conservative DCA
-@retry(wait=wait_fixed(10))
 def requests_call(method, url, timeout):
-    response = []
-    try:
+    # last good response is used while the fear and greed index API is down,
+    # bots running in one process share responses younger than a minute
+    def request(timeout):
         response = requests.request(method, url, timeout=timeout)
-    except Exception as e:
-        raise IOError(
-            "Fear and greed index API actually down, retrying in 10s, Error is:" + e
-        )
-    return response
+        response.raise_for_status()
+        return response
+
+    return endpoint("alternative.me", timeout=timeout, max_timeout=timeout * 3).call(
+        request, key=(method, url), max_age=60
+    )
 
 
 async def get_fgi(ema_fast, ema_slow):
@@ -386,7 +502,7 @@ async def get_fgi(ema_fast, ema_slow):
             fgi_values = []
             fgi_ema_fast = []
             fgi_ema_slow = []
-            response = requests_call("GET", url, 5)
+            response = await asyncio.to_thread(requests_call, "GET", url, 5)
             raw_data = json.loads(response.text)
             for i in range(len(raw_data["data"])):
                 fgi_values.insert(0, int(raw_data["data"][i]["value"]))
@@ -408,8 +524,9 @@ async def get_fgi(ema_fast, ema_slow):
                 # calculate EMA crosses if fgi_pulse == True
                 if attributes.get("fgi_pulse", False):
                     if fgi_ema_fast[-1] < fgi_ema_slow[-1]:
-                        asyncState.fgi_downtrend = True
-                        asyncState.fgi_allows_trading = False
+                        asyncState.update(
+                            fgi_downtrend=True, fgi_allows_trading=False
+                        )
                         output_str = "FGI-EMA{0:d}: {1:.1f}".format(
                             ema_fast, fgi_ema_fast[-1]
                         ) + " less than FGI-EMA{:d}: {:.1f}".format(
@@ -464,8 +581,7 @@ async def get_fgi(ema_fast, ema_slow):
                     if ((fgi_values[-2] - fgi_values[-1]) >= 10) or (
                         (fgi_values[-3] - fgi_values[-1]) >= 15
                     ):
-                        asyncState.fgi_drop = True
-                        asyncState.fgi_allows_trading = False
+                        asyncState.update(fgi_drop=True, fgi_allows_trading=False)
                         logging.info(
                             f"FGI actual/yesterday/before yesterday: {fgi_values[-1]}/{fgi_values[-2]}/{fgi_values[-3]}",
                             True,
@@ -519,10 +635,13 @@ async def get_fgi(ema_fast, ema_slow):
                 asyncState.fgi_time_until_update = time_until_update
 
             notification.send_notification()
+            ready("fgi").set()
             # request FGI once per day, because is is calculated only once per day
             await asyncio.sleep(time_until_update)
         except Exception as err:
             logging.error(f"Exception raised by async get_fgi: {err}")
+            # startup continues without FGI value
+            ready("fgi").set()
             await asyncio.sleep(3600)
 
 
@@ -539,16 +658,32 @@ def ema(data, period, smoothing=2):
         )
 
     for i in range(period - 1):
-        ema.insert(0, np.nan)
+        ema.insert(0, math.nan)
 
     return ema
 
 
 # Credits goes to @IamtheOnewhoKnocks from
 # https://discord.gg/tradealts
-@retry(wait=wait_fixed(2))
 def btctechnical(symbol):
-    btcusdt = yf.download(tickers=symbol, period="6h", interval="5m", progress=False)
+    # yfinance pulls in pandas, so it is only loaded with btc_pulse enabled
+    import numpy as np
+    import yfinance as yf
+
+    # last good chart of the past 15 minutes is used while yfinance is down, an
+    # older one raises and get_btcpulse skips the decision. Bots running in one
+    # process share charts younger than a minute
+    def download(timeout):
+        chart = yf.download(
+            tickers=symbol, period="6h", interval="5m", progress=False, timeout=timeout
+        )
+        if len(chart) == 0:
+            raise IOError("Downloading YFinance chart broken")
+        return chart
+
+    btcusdt = endpoint("yfinance", timeout=10).call(
+        download, key=symbol, max_age=60, fallback_age=900
+    )
     if len(btcusdt) > 0:
         btcusdt = btcusdt.iloc[:, :5]
         btcusdt.columns = ["Time", "Open", "High", "Low", "Close"]
@@ -742,17 +877,35 @@ async def fgi_dca_conf_change(interval_sec):
                 )
                 asyncState.dca_conf = "dcabot"
             notification.send_notification()
+            ready("dca_conf").set()
             await asyncio.sleep(interval_sec)
         except Exception as err:
             logging.error(f"Exception raised by async fgi_dca_conf_change: {err}")
+            ready("dca_conf").set()
             await asyncio.sleep(interval_sec)
 
 
-async def bot_switch(interval_sec):
+async def bot_switch(retry_sec):
+    # Enable or disable the bots as soon as btc_downtrend, fgi_allows_trading
+    # or bot_active change, the flags are published by asyncState. A failed
+    # switch is tried again every retry_sec seconds
+    regime_changed = asyncio.Event()
+    asyncState.subscribe(
+        ("btc_downtrend", "fgi_allows_trading", "bot_active"),
+        lambda name, old, new: regime_changed.set(),
+    )
+    single_disable_failed = False
 
     while True:
         try:
-            logging.debug("bot_switch: begin of while loop")
+            regime_changed.clear()
+            logging.debug("bot_switch: market regime changed")
+            trading = not asyncState.btc_downtrend and asyncState.fgi_allows_trading
+
+            if not trading:
+                # a pending symrank list would enable the bot again
+                if asyncState.symrank_task:
+                    asyncState.symrank_task.cancel()
 
             if (
                 not asyncState.bot_active
@@ -760,6 +913,7 @@ async def bot_switch(interval_sec):
                 and asyncState.fgi_allows_trading
             ):
                 if attributes.get("single"):
+                    single_disable_failed = False
                     asyncState.bot_active = True
                     logging.info(
                         "Single bot mode activated - waiting for pair #start signals",
@@ -791,6 +945,7 @@ async def bot_switch(interval_sec):
                             logging,
                             asyncState,
                         )
+                    await wait_for_budget(SWITCH)
                     bot.enable()
                     asyncState.bot_active = asyncState.multibot["is_enabled"]
                     logging.info(
@@ -798,24 +953,21 @@ async def bot_switch(interval_sec):
                         True,
                     )
                 # enables 3cqsbot only after sending symrank call to avoid messing up with old pairs
-                else:
+                elif not asyncState.symrank_task or asyncState.symrank_task.done():
                     logging.info(
                         "Multi bot will be activated after processing top30 symrank list",
                         True,
                     )
                     asyncState.symrank_success = False
-                    while not asyncState.symrank_success:
-                        await symrank()
+                    start_symrank()
 
-            elif asyncState.bot_active and (
-                asyncState.btc_downtrend or not asyncState.fgi_allows_trading
-            ):
+            elif (asyncState.bot_active or single_disable_failed) and not trading:
                 if attributes.get("single"):
-                    bot = SingleBot(
-                        [], bot_data(), {}, attributes, p3cw, logging, asyncState
-                    )
+                    bots = bot_data()
+                    bot = SingleBot([], bots, {}, attributes, p3cw, logging, asyncState)
                     # True = disable all single bots
-                    bot.disable(bot_data(), True)
+                    await wait_for_budget(SWITCH)
+                    single_disable_failed = not bot.disable(bots, True)
                 else:
                     if asyncState.multibot == {}:
                         bot = MultiBot(
@@ -839,17 +991,90 @@ async def bot_switch(interval_sec):
                             logging,
                             asyncState,
                         )
+                    await wait_for_budget(SWITCH)
                     bot.disable()
                     asyncState.bot_active = asyncState.multibot["is_enabled"]
             else:
                 logging.debug("bot_switch: Nothing do to")
 
             notification.send_notification()
-            await asyncio.sleep(interval_sec)
+
+            if attributes.get("single"):
+                switch_failed = single_disable_failed
+            else:
+                # the multibot could not be enabled or disabled, unless the
+                # symrank list is still awaited to enable it
+                switch_failed = asyncState.bot_active != trading and not (
+                    asyncState.symrank_task and not asyncState.symrank_task.done()
+                )
+            if switch_failed:
+                try:
+                    await asyncio.wait_for(regime_changed.wait(), retry_sec)
+                except asyncio.TimeoutError:
+                    logging.info("bot_switch: retrying to switch the bots", True)
+            else:
+                await regime_changed.wait()
         except Exception as err:
             logging.error(f"Exception raised by async bot_switch: {err}")
-            logging.error(f"bot_switch: Sleeping for {interval_sec}sec")
+            logging.error(f"bot_switch: Sleeping for {retry_sec}sec")
+            await asyncio.sleep(retry_sec)
+
+
+async def track_deals(interval_sec):
+    # Poll the active deals in the background, deal reports are served from
+    # asyncState.deal_tracker without requests on the signal path
+    single_bot_name = None
+    while True:
+        try:
+            payload = {"limit": 100, "scope": "active"}
+            if attributes.get("single"):
+                if not single_bot_name:
+                    single_bot_name = SingleBot(
+                        [], [], {}, attributes, p3cw, logging, asyncState
+                    ).bot_pattern
+                payload["account_id"] = asyncState.account_data["id"]
+            elif asyncState.multibot:
+                payload["bot_id"] = asyncState.multibot["id"]
+            else:
+                payload = {}
+
+            if payload:
+                error, data = await asyncio.to_thread(
+                    p3cw.request,
+                    entity="deals",
+                    action="",
+                    action_id="",
+                    additional_headers={"Forced-Mode": attributes.get("trade_mode")},
+                    payload=payload,
+                )
+                if error:
+                    logging.error("function track_deals: " + error["msg"])
+                else:
+                    if single_bot_name:
+                        data = [
+                            deal
+                            for deal in data
+                            if single_bot_name.search(deal.get("bot_name", ""))
+                        ]
+                    asyncState.deal_tracker.update(data)
+                    logging.debug(
+                        "Active deals: "
+                        + str(len(asyncState.deal_tracker))
+                        + " - uPNL: "
+                        + str(round(asyncState.deal_tracker.upnl, 2))
+                    )
+
             await asyncio.sleep(interval_sec)
+        except Exception as err:
+            logging.error(f"Exception raised by async track_deals: {err}")
+            await asyncio.sleep(interval_sec)
+
+
+def ready(name):
+    # Set once the first result of a startup step is available, see main()
+    if name not in asyncState.ready:
+        asyncState.ready[name] = asyncio.Event()
+    return asyncState.ready[name]
 
 
 def _handle_task_result(task: asyncio.Task) -> None:
@@ -862,21 +1087,106 @@ def _handle_task_result(task: asyncio.Task) -> None:
         logging.error(f"Exception raised by task = {task}")
 
 
-async def symrank():
+async def flush_bot_updates(window):
+    # Wait for further signals within the update window, then push the merged pair list
+    # and report the deals, off the path from signal to deal start
+    await asyncio.sleep(window)
+    await wait_for_budget(UPDATE)
+    asyncState.update_flush = None
+    if asyncState.lease and not asyncState.lease.held():
+        logging.error("Lease not held - pending bot updates dropped")
+        asyncState.pending_signals = []
+        asyncState.pending_updates = 0
+        asyncState.pending_deals = []
+        asyncState.pending_report = None
+        return
+    bot = MultiBot(
+        [],
+        asyncState.multibot,
+        asyncState.account_data,
+        asyncState.pair_data,
+        attributes,
+        p3cw,
+        logging,
+        asyncState,
+    )
+    bot.flush()
+    asyncState.bot_active = asyncState.multibot["is_enabled"]
+    notification.send_notification()
+    if asyncState.signal_queue and asyncState.pending_signals:
+        asyncState.signal_queue.done(*asyncState.pending_signals)
+        asyncState.pending_signals = []
+
 
+async def wait_for_budget(priority):
+    # Let more important 3Commas requests go first without blocking the loop
+    wait = p3cw.budget.wait(priority)
+    if wait:
+        await asyncio.sleep(wait)
+
+
+async def lease_keeper(interval_sec):
+    # Renew the lease of the active instance, stop if the standby has taken over
+    while True:
+        await asyncio.sleep(interval_sec)
+        if not asyncState.lease.acquire() and not asyncState.lease.held():
+            asyncState.receive_signals = False
+            logging.error("Lease lost to the standby 3cqsbot - stopping", True)
+            notification.send_notification()
+            sys.exit("Lease lost to the standby 3cqsbot")
+        # signals received while the lease had lapsed
+        if asyncState.deferred_events and not asyncState.catching_up:
+            await process_deferred()
+
+
+async def symrank(timeout=30):
+    # Send /symrank and wait until handle_signal resolves asyncState.symrank_reply
+    # with the list. Without a usable list the command is repeated after a jittered
+    # delay, which doubles after each unanswered command up to 10min
     logging.info(
         "Sending /symrank command to 3C Quick Stats on Telegram to get new pairs"
     )
-    while not asyncState.symrank_success:
-        await client.send_message(asyncState.chatid, "/symrank")
-        await asyncio.sleep(5)
-        # prevent from calling the symrank command too much otherwise a timeout is caused
-        if not asyncState.symrank_success:
-            await asyncio.sleep(asyncState.symrank_retry)
+    delay = asyncState.symrank_retry
+    try:
+        while not asyncState.symrank_success:
+            asyncState.symrank_reply = client.loop.create_future()
+            await client.send_message(asyncState.chatid, "/symrank")
+            try:
+                await asyncio.wait_for(asyncState.symrank_reply, timeout)
+                retry = delay = asyncState.symrank_retry
+            except asyncio.TimeoutError:
+                logging.info(
+                    "No symrank list received within " + str(timeout) + "s", True
+                )
+                retry = delay
+                delay = min(delay * 2, 600)
+            # prevent from calling the symrank command too much otherwise a timeout is caused
+            if not asyncState.symrank_success:
+                await asyncio.sleep(retry * random.uniform(0.8, 1.2))
+    except asyncio.CancelledError:
+        logging.info("Symrank request cancelled")
+        raise
+    finally:
+        asyncState.symrank_reply = None
     # reset to 60sec in case of success after topcoin filter
     asyncState.symrank_retry = 60
 
 
+def start_symrank():
+    # main() and bot_switch share one symrank request
+    if not asyncState.symrank_task or asyncState.symrank_task.done():
+        asyncState.symrank_task = client.loop.create_task(symrank())
+        asyncState.symrank_task.add_done_callback(_handle_task_result)
+    return asyncState.symrank_task
+
+
+async def request_symrank():
+    # False if the request was cancelled because the bot got disabled meanwhile
+    task = start_symrank()
+    await asyncio.wait({task})
+    return not task.cancelled()
+
+
 def get_deal_mode():
     strategy = attributes.get("deal_mode", "test", asyncState.dca_conf)
     if strategy == "test":
@@ -884,14 +1194,210 @@ def get_deal_mode():
     return strategy
 
 
+def signal_processed(id):
+    # Signals with bot updates or deals still pending are done after the flush
+    if asyncState.update_flush:
+        asyncState.pending_signals.append(id)
+    else:
+        asyncState.signal_queue.done(id)
+
+
+async def replay_signals():
+    # Process the signals received but not processed before the last stop or
+    # while starting up, as long as they are younger than signal_max_age
+    signals = asyncState.signal_queue.replay()
+    if signals:
+        logging.info(
+            "Replaying " + str(len(signals)) + " unprocessed signal(s)",
+            True,
+        )
+    for id, date, raw_text in signals:
+        await handle_signal(SimpleNamespace(id=id, raw_text=raw_text))
+        signal_processed(id)
+        remember_message(id)
+
+
+def load_last_message():
+    try:
+        with open(os.path.join(datadir, program + "_last_message")) as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def remember_message(id):
+    # Persist the id of the last processed message, catch_up() continues after it
+    if id > asyncState.last_message_id:
+        asyncState.last_message_id = id
+        path = os.path.join(datadir, program + "_last_message")
+        with open(path + ".tmp", "w") as file:
+            file.write(str(id))
+        os.replace(path + ".tmp", path)
+
+
+async def catch_up(before=0, queued=()):
+    # Apply the signals missed while 3cqsbot was stopped or disconnected, up to
+    # the message id before if given. Per pair only the last START/STOP counts,
+    # the pair list changes are sent in one bot update and no deals are started
+    # for missed signals. Queued signals are left to replay_signals().
+    if not asyncState.last_message_id:
+        return
+
+    asyncState.catching_up = True
+    try:
+        missed = 0
+        while True:
+            # live messages are deferred meanwhile and handled afterwards,
+            # the catch-up ends before the first of them
+            messages = [
+                message
+                async for message in client.iter_messages(
+                    asyncState.chatroom,
+                    min_id=asyncState.last_message_id,
+                    max_id=first_live_message(before),
+                    reverse=True,
+                )
+            ]
+            bound = first_live_message(before)
+            messages = [
+                message for message in messages if not bound or message.id < bound
+            ]
+            if not messages:
+                break
+            missed += len(messages)
+
+            latest = {}
+            for message in messages:
+                if message.id in queued:
+                    continue
+                tg_output = tg_data(parse_tg(message.raw_text))
+                if isinstance(tg_output, dict):
+                    latest.pop(tg_output["pair"], None)
+                    latest[tg_output["pair"]] = (tg_output["action"], message)
+
+            for action, message in latest.values():
+                # missed START signals would create single bots and start deals
+                if attributes.get("single") and action == "START":
+                    continue
+                await handle_signal(message)
+            remember_message(messages[-1].id)
+
+        if missed:
+            logging.info(
+                "Caught up on " + str(missed) + " missed Telegram message(s)", True
+            )
+    finally:
+        asyncState.catching_up = False
+
+    await process_deferred()
+
+
+def first_live_message(before=0):
+    # Lowest id of the messages received live during a catch-up, 0 if none
+    ids = [event.id for event in asyncState.deferred_events]
+    if before:
+        ids.append(before)
+    return min(ids, default=0)
+
+
+@client.on_reconnect
+async def reconnected():
+    # Telethon reconnected on its own, catch up on the messages missed meanwhile.
+    # A standby leaves them to the instance taking over
+    if (
+        not asyncState.receive_signals
+        or asyncState.catching_up
+        or (asyncState.lease and not asyncState.lease.held())
+    ):
+        return
+    try:
+        logging.info(
+            "Telegram connection restored - catching up on missed signals", True
+        )
+        await catch_up()
+        notification.send_notification()
+    except Exception as err:
+        logging.error(f"Exception raised by async reconnected: {err}")
+
+
+async def process_deferred():
+    deferred = asyncState.deferred_events
+    asyncState.deferred_events = []
+    for event in deferred:
+        await my_event_handler(event)
+
+
 @client.on(events.NewMessage(chats=attributes.get("chatroom", "3C Quick Stats")))
 async def my_event_handler(event):
+    # messages up to the last processed one were handled already, e.g. by catch_up()
+    if event.id <= asyncState.last_message_id:
+        return
+    # processed after the missed messages
+    if asyncState.catching_up:
+        asyncState.deferred_events.append(event)
+        return
+
+    standby = False
+    lease = asyncState.lease
+    if attributes.get("lease_file", False) and not (lease and lease.held()):
+        if lease and lease.taken():
+            standby = True
+        elif lease:
+            # lease lapsed, processed by lease_keeper once it is renewed
+            asyncState.deferred_events.append(event)
+            return
+        # without a lease yet the signal is kept like any signal before startup
+    queue = asyncState.signal_queue
+    if queue:
+        # store the signal before processing it, repeated deliveries are dropped
+        if not queue.add(event.id, event.date.timestamp(), event.raw_text):
+            logging.debug("Message " + str(event.id) + " already received - ignored")
+            return
+    # standby, the signal stays pending and is replayed or caught up after a
+    # takeover, deals started by the active instance are claimed in the lease file
+    if standby:
+        return
+    # not ready yet, the signal is replayed or caught up once signals are processed
+    if not asyncState.receive_signals:
+        return
+
+    await handle_signal(event)
+    if not asyncState.first_signal_time and asyncState.start_time:
+        asyncState.first_signal_time = datetime.utcnow()
+        logging.info(
+            "Time to first signal: "
+            + str(
+                round(
+                    (asyncState.first_signal_time - asyncState.start_time).total_seconds(),
+                    1,
+                )
+            )
+            + "s"
+        )
+
+    if queue:
+        signal_processed(event.id)
+    remember_message(event.id)
+
+
+async def handle_signal(event):
     more_inform = attributes.get("extensive_notifications", False)
     tg_output = tg_data(parse_tg(event.raw_text))
+    if isinstance(tg_output, dict):
+        # message id of the signal, used for idempotent deal starts
+        tg_output["id"] = event.id
     logging.debug("TG msg: " + str(tg_output))
     dealmode_signal = get_deal_mode() == "signal"
 
-    if tg_output and asyncState.fgi_allows_trading and asyncState.receive_signals:
+    # a stalled active instance must not act once the standby may have taken over
+    lease_held = not asyncState.lease or asyncState.lease.held()
+
+    if (
+        tg_output
+        and asyncState.fgi_allows_trading
+        and asyncState.receive_signals
+        and lease_held
+    ):
         account_output = asyncState.account_data
         pair_output = asyncState.pair_data
 
@@ -1054,6 +1560,14 @@ async def my_event_handler(event):
 
                 bot.trigger()
                 if not attributes.get("single"):
+                    if (
+                        asyncState.pending_updates
+                        or asyncState.pending_report is not None
+                    ) and not asyncState.update_flush:
+                        asyncState.update_flush = client.loop.create_task(
+                            flush_bot_updates(attributes.get("update_window", 0))
+                        )
+                        asyncState.update_flush.add_done_callback(_handle_task_result)
                     asyncState.bot_active = asyncState.multibot["is_enabled"]
 
         ##### if TG message is symrank list
@@ -1087,33 +1601,16 @@ async def my_event_handler(event):
                 logging.debug(
                     "Ignoring /symrank call, because we're running in single mode!"
                 )
+            # wake up a waiting symrank() only after the list has been applied
+            if asyncState.symrank_reply and not asyncState.symrank_reply.done():
+                asyncState.symrank_reply.set_result(asyncState.symrank_success)
 
     notification.send_notification()
 
 
 def report_funds_needed(dca_conf="dcabot"):
-    tp = attributes.get("tp", "", dca_conf)  # take profit
-    bo = attributes.get("bo", "", dca_conf)  # base order
-    so = attributes.get("so", "", dca_conf)  # safety order
-    os = attributes.get("os", "", dca_conf)  # safety order volume scale
-    ss = attributes.get("ss", "", dca_conf)  # safety order step scale
-    sos = attributes.get("sos", "", dca_conf)  # price deviation to open safety orders
-    mstc = attributes.get("mstc", "", dca_conf)  # max safety trade count
-
-    fundsneeded = bo + so
-    amount = so
-    pd = sos
-    cum_size_base = bo + so / (1 - (1 * sos / 100))
-    for i in range(mstc - 1):
-        amount = amount * os
-        fundsneeded += amount
-        pd = (pd * ss) + sos
-        price = (100 - pd) / 100
-        size_base = amount / price
-        cum_size_base += size_base
-        avg_price = fundsneeded / cum_size_base
-        required_price = avg_price * tp / 100 + avg_price
-        required_change = ((required_price / price) - 1) * 100
+    # funds per deal, covered max price deviation and max required change of the DCA setting
+    fundsneeded, pd, required_change = funds_needed(attributes, dca_conf)
 
     if attributes.get("single"):
         maxdeals = int(attributes.get("single_count", "0", dca_conf))
@@ -1315,6 +1812,8 @@ async def report_statistics():
                 asyncState.start_signals_topcoin_filter_passed_24h
             )
             asyncState.stop_signals += asyncState.stop_signals_24h
+            asyncState.bot_updates_saved += asyncState.bot_updates_saved_24h
+            asyncState.fast_path_deals += asyncState.fast_path_deals_24h
 
             asyncState.start_signals_24h = 0
             asyncState.start_signals_not_tradeable_24h = 0
@@ -1322,6 +1821,8 @@ async def report_statistics():
             asyncState.start_signals_symrank_filter_passed_24h = 0
             asyncState.start_signals_topcoin_filter_passed_24h = 0
             asyncState.stop_signals_24h = 0
+            asyncState.bot_updates_saved_24h = 0
+            asyncState.fast_path_deals_24h = 0
 
             start_per_day = asyncState.start_signals / (start_delta / timedelta(days=1))
             stop_per_day = asyncState.stop_signals / (start_delta / timedelta(days=1))
@@ -1356,6 +1857,66 @@ async def report_statistics():
                 + str(asyncState.start_signals_topcoin_filter_passed),
                 True,
             )
+            if attributes.get("update_window", 0):
+                logging.info(
+                    "Bot update calls saved by merging pair list changes: "
+                    + str(asyncState.bot_updates_saved),
+                    True,
+                )
+            if get_deal_mode() == "signal" and not attributes.get("single"):
+                logging.info(
+                    "Total deals started before the bot update (pair already listed): "
+                    + str(asyncState.fast_path_deals),
+                    True,
+                )
+
+        for name, api in api_metrics().items():
+            logging.info(
+                "API "
+                + name
+                + ": circuit "
+                + api["state"]
+                + " - latency p50/p99: "
+                + f"{api['p50']:.2f}/{api['p99']:.2f}s"
+                + " - timeout: "
+                + f"{api['timeout']:.1f}s"
+                + " - failed: "
+                + str(api["failed"])
+                + " of "
+                + str(api["calls"])
+                + " calls - retries: "
+                + str(api["retried"])
+                + " - rejected: "
+                + str(api["rejected"])
+                + " - served from cache: "
+                + str(api["fallbacks"]),
+                True,
+            )
+
+        if attributes.get("loop_lag_threshold", 0.5):
+            lag = loop_monitor(logging).metrics()
+            logging.info(
+                "Event loop lag p50/p99/max: "
+                + f"{lag['p50']:.3f}/{lag['p99']:.3f}/{lag['max_lag']:.2f}s"
+                + " - blocked "
+                + str(lag["stalls"])
+                + " times for "
+                + f"{lag['stalled_time']:.1f}s",
+                True,
+            )
+
+        for name, counters in p3cw.budget.counters.items():
+            logging.info(
+                "3commas '"
+                + name
+                + "' requests - sent: "
+                + str(counters["sent"])
+                + " - waited for rate limit: "
+                + str(counters["waited"])
+                + " - deferred: "
+                + str(counters["deferred"]),
+                True,
+            )
 
         logging.info("Actual DCA bot setting:", True)
         report_dca_settings(asyncState.dca_conf)
@@ -1401,45 +1962,58 @@ async def report_statistics():
         await asyncio.sleep(time_until_update.seconds + 1)
 
 
-async def main():
-
-    # Check for single instance run
-    single_instance_check()
+def report_startup():
+    # yfinance with pandas (btc_pulse), pycoingecko (topcoin_filter) and apprise
+    # (notifications) are only imported when their feature is enabled
+    subsystems = [
+        name
+        for name in ("btc_pulse", "topcoin_filter", "notifications")
+        if attributes.get(name, False)
+    ]
+    message = "Startup took " + str(round(process_time(), 2)) + "s CPU time"
+    if resource:
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024
+        message += " - peak memory " + str(round(peak / 1024**2)) + " MB"
+    logging.info(
+        message + " - optional subsystems enabled: " + (", ".join(subsystems) or "none")
+    )
 
-    signals = Signals(logging)
 
-    ##### Initial reporting #####
-    logging.info("********** 3CQS Bot started **********", True)
-    asyncState.start_time = datetime.utcnow()
+async def start_telegram():
     user = await client.get_participants("The3CQSBot")
     asyncState.chatid = user[0].id
+    # chat of the signals, missed messages are fetched from it
+    asyncState.chatroom = await client.get_input_entity(
+        attributes.get("chatroom", "3C Quick Stats")
+    )
+
 
-    asyncState.account_data = account_data()
+async def start_3commas():
+    # 3Commas requests are sent one after another, off the event loop where
+    # possible. Returns the bots for the search of the multibot
+    asyncState.account_data = await asyncio.to_thread(account_data)
     # Update available pair_data every 360 minutes for e.g. new blacklisted pairs or new tradable pairs
     pair_data_task = client.loop.create_task(
         pair_data(asyncState.account_data, 3600 * 6)
     )
     pair_data_task.add_done_callback(_handle_task_result)
-    await asyncio.sleep(3)
+    await ready("pair_data").wait()
 
-    report_config()
+    if attributes.get("single"):
+        return None
+    return await asyncio.to_thread(bot_data)
 
-    # Check for inconsistencies of bot switching before starting 3cqsbot
-    if attributes.get("btc_pulse", False) and attributes.get("ext_botswitch", False):
-        sys.tracebacklimit = 0
-        sys.exit(
-            "Check config.ini: btc_pulse AND ext_botswitch both set to true - not allowed"
-        )
 
+async def start_fgi():
     # Obtain FGI values in the background
-    if attributes.get("fgi_pulse", False) or attributes.get("fgi_trading", False):
-        get_fgi_task = client.loop.create_task(
-            get_fgi(
-                attributes.get("fgi_ema_fast", 9), attributes.get("fgi_ema_slow", 20)
-            )
-        )
-        get_fgi_task.add_done_callback(_handle_task_result)
-        await asyncio.sleep(3)
+    get_fgi_task = client.loop.create_task(
+        get_fgi(attributes.get("fgi_ema_fast", 9), attributes.get("fgi_ema_slow", 20))
+    )
+    get_fgi_task.add_done_callback(_handle_task_result)
+    await ready("fgi").wait()
 
     # Enable FGI dependent trading
     if attributes.get("fgi_trading", False):
@@ -1447,7 +2021,7 @@ async def main():
             fgi_dca_conf_change(3600)
         )  # check once per hour
         fgi_dca_conf_change_task.add_done_callback(_handle_task_result)
-        await asyncio.sleep(1)
+        await ready("dca_conf").wait()
 
         logging.info("DCA setting: '[" + asyncState.dca_conf + "]'", True)
         logging.info(
@@ -1455,6 +2029,57 @@ async def main():
             True,
         )
 
+
+async def main():
+
+    # Check for single instance run
+    single_instance_check()
+
+    # Store incoming signals before processing, to replay them after a restart
+    if attributes.get("signal_queue", False):
+        asyncState.signal_queue = SignalQueue(
+            os.path.join(datadir, program + "_signals.db"),
+            attributes.get("signal_max_age", 300),
+        )
+        asyncState.signal_queue.prune()
+    asyncState.last_message_id = load_last_message()
+
+    signals = Signals(logging)
+
+    # Measure the event loop lag, the stack of calls blocking the loop is logged
+    if attributes.get("loop_lag_threshold", 0.5):
+        monitor = loop_monitor(
+            logging, threshold=attributes.get("loop_lag_threshold", 0.5)
+        )
+        loop_monitor_task = client.loop.create_task(monitor.run())
+        loop_monitor_task.add_done_callback(_handle_task_result)
+
+    ##### Initial reporting #####
+    logging.info("********** 3CQS Bot started **********", True)
+    report_startup()
+    asyncState.start_time = datetime.utcnow()
+
+    # Check for inconsistencies of bot switching before starting 3cqsbot
+    if attributes.get("btc_pulse", False) and attributes.get("ext_botswitch", False):
+        sys.tracebacklimit = 0
+        sys.exit(
+            "Check config.ini: btc_pulse AND ext_botswitch both set to true - not allowed"
+        )
+
+    # Telegram, 3Commas and FGI start up concurrently, see start_telegram(),
+    # start_3commas() and start_fgi()
+    startup = [start_telegram(), start_3commas()]
+    if attributes.get("fgi_pulse", False) or attributes.get("fgi_trading", False):
+        startup.append(start_fgi())
+    bots = (await asyncio.gather(*startup))[1]
+
+    report_config()
+
+    # Pre-evaluate topcoin filter of tradeable pairs in the background
+    if attributes.get("topcoin_filter", False):
+        topcoin_task = client.loop.create_task(topcoin_decisions(3600))
+        topcoin_task.add_done_callback(_handle_task_result)
+
     # Enable btc_pulse dependent trading
     if attributes.get("btc_pulse", False):
         asyncState.btc_downtrend = True
@@ -1463,6 +2088,31 @@ async def main():
     else:
         asyncState.btc_downtrend = False
 
+    # Hot standby: keep the caches warm until the lease of the active instance expires
+    if attributes.get("lease_file", False):
+        lease_time = attributes.get("lease_time", 15)
+        asyncState.lease = Lease(
+            attributes.get("lease_file"),
+            socket.gethostname() + ":" + str(os.getpid()) + ":" + datadir,
+            lease_time,
+        )
+        asyncState.lease.prune()
+        if not asyncState.lease.acquire():
+            logging.info(
+                "Standby - waiting for the lease of the active 3cqsbot in '"
+                + attributes.get("lease_file")
+                + "'",
+                True,
+            )
+            notification.send_notification()
+            while not asyncState.lease.acquire():
+                await asyncio.sleep(lease_time / 3)
+            # the active instance may have changed the bots meanwhile
+            bots = None
+        logging.info("Lease acquired - running as active 3cqsbot", True)
+        lease_task = client.loop.create_task(lease_keeper(lease_time / 3))
+        lease_task.add_done_callback(_handle_task_result)
+
     # Central Bot Switching module for btc_pulse and FGI
     if (
         attributes.get("btc_pulse", False)
@@ -1476,7 +2126,7 @@ async def main():
     if asyncState.multibot == {} and not attributes.get("single"):
         bot = MultiBot(
             [],
-            bot_data(),
+            bots or bot_data(),
             asyncState.account_data,
             0,
             attributes,
@@ -1490,9 +2140,12 @@ async def main():
         else:
             asyncState.bot_active = False
 
+    # Poll active deals for the deal reports in the background
+    track_deals_task = client.loop.create_task(track_deals(300))
+    track_deals_task.add_done_callback(_handle_task_result)
+
     report_statistics_task = client.loop.create_task(report_statistics())
     report_statistics_task.add_done_callback(_handle_task_result)
-    await asyncio.sleep(3)
 
     ##### Wait for TG signals of 3C Quick Stats channel #####
     logging.info(
@@ -1502,6 +2155,23 @@ async def main():
         True,
     )
     asyncState.receive_signals = True
+    logging.info(
+        "Ready for signals "
+        + str(round((datetime.utcnow() - asyncState.start_time).total_seconds(), 1))
+        + "s after start"
+    )
+    if asyncState.signal_queue:
+        # replay_signals() remembers the signals received since start, the
+        # messages missed before them are caught up first
+        started = asyncState.start_time.replace(tzinfo=timezone.utc).timestamp()
+        queued = asyncState.signal_queue.replay()
+        live = [id for id, date, raw_text in queued if date >= started]
+        await catch_up(
+            min(live) if live else 0, {id for id, date, raw_text in queued}
+        )
+        await replay_signals()
+    else:
+        await catch_up()
     notification.send_notification()
 
     if get_deal_mode() != "signal":
@@ -1510,12 +2180,20 @@ async def main():
             and not asyncState.symrank_success
             and not attributes.get("single")
         ):
-            await symrank()
+            # bot_switch requests the list again once trading is enabled
+            if not await request_symrank():
+                break
 
 
-try:
-    client.start()
-    client.loop.run_until_complete(main())
-    client.run_until_disconnected()
-except Exception as err:
-    logging.error(f"Exception raised by Telegram client: {err}")
+if not TENANT:
+    try:
+        client.start()
+        client.loop.run_until_complete(main())
+        client.run_until_disconnected()
+    except Exception as err:
+        logging.error(f"Exception raised by Telegram client: {err}")
+    finally:
+        # hand over to the standby right away
+        if asyncState.lease and asyncState.lease.held():
+            asyncState.lease.release()
+        logging.debug("State at exit: " + asyncState.serialize())
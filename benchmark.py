@@ -0,0 +1,498 @@
+"""Micro- and macro-benchmarks for the 3cqsbot hot paths with JSON output."""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote_plus, urlencode
+
+import pandas as pd
+from py3cw.config import API_METHODS
+
+from commas_stub import API_PREFIX, StubError, Stub3Commas
+from config import Config
+from multibot import MultiBot
+from resilience import RequestBudget
+from signals import Signals
+from singlebot import SingleBot
+
+BOT_SCRIPT = Path(__file__).parent / "3cqsbot.py"
+
+FIXTURE_CONFIG = """
+[general]
+debug = False
+
+[telegram]
+api_id = 123456
+api_hash = benchmark
+
+[commas]
+key = benchmark
+secret = benchmark
+
+[dcabot]
+prefix = 3CQSBOT
+subprefix = MULTI
+suffix = dcabot
+single_count = 10
+mad = 50
+deal_mode = signal
+tp = 1.5
+bo = 11
+so = 11
+os = 1.05
+ss = 1
+sos = 2.4
+mstc = 25
+max = 1
+sdsp = 1
+
+[trading]
+market = USDT
+trade_mode = paper
+account_name = Paper trading 123456
+single = False
+
+[filter]
+symrank_signal = quadruple100
+topcoin_filter = False
+"""
+
+
+######################################################
+#                      Fixtures                      #
+######################################################
+
+
+class QuietLogger:
+    """Drop-in for logger.Logger that discards all output."""
+
+    def info(self, message, notify=False):
+        pass
+
+    def warning(self, message, notify=True):
+        pass
+
+    def error(self, message, notify=True):
+        pass
+
+    def debug(self, message, notify=False):
+        pass
+
+
+class QuietNotification:
+    def send_notification(self):
+        pass
+
+
+class StubP3cw:
+    """Py3CW compatible client calling the commas_stub state directly, without HTTP."""
+
+    def __init__(self, stub):
+        self.stub = stub
+        # no rate limit, the stub's own limit is off as well
+        self.budget = RequestBudget(10**6)
+
+    def request(
+        self,
+        entity,
+        action="",
+        action_id=None,
+        action_sub_id=None,
+        payload=None,
+        additional_headers=None,
+    ):
+        method, api_path = API_METHODS[entity][action]
+        api_path = api_path.replace("{id}", action_id or "")
+        path = API_PREFIX + entity + ("/" + api_path if api_path else "")
+        query = {}
+        body = None
+        if method == "GET" and payload is not None:
+            # same round trip through the query string as py3cw
+            query = dict(
+                pair.split("=")
+                for pair in urlencode(payload, quote_via=quote_plus).split("&")
+            )
+        else:
+            body = payload
+        try:
+            return {}, self.stub.dispatch(method, path, query, body)
+        except StubError as err:
+            # py3cw adds the HTTP status to API errors
+            return dict(err.body, status_code=err.status), {}
+
+
+def fixture_config(directory):
+    with open(os.path.join(directory, "benchmark.ini"), "w") as configfile:
+        configfile.write(FIXTURE_CONFIG)
+    return Config(directory, "benchmark")
+
+
+def fixture_market(coins=3500):
+    rnd = random.Random(42)
+    market = [
+        {"id": "bitcoin", "symbol": "btc", "market_cap_rank": 1},
+        {"id": "ethereum", "symbol": "eth", "market_cap_rank": 2},
+    ]
+    for i in range(coins - len(market)):
+        market.append(
+            {
+                "id": "token-" + str(i),
+                "symbol": "tok" + str(i),
+                "market_cap_rank": i + 3,
+            }
+        )
+    rnd.shuffle(market)
+    return market
+
+
+def fixture_exchange(coin_id):
+    rnd = random.Random(coin_id)
+    btc = rnd.uniform(1, 5000)
+    return {
+        "name": "Binance",
+        "tickers": [
+            {
+                "base": coin_id.split("-")[-1].upper(),
+                "target": target,
+                "converted_volume": {"btc": btc, "usd": btc * 20000},
+            }
+            for target in ("BTC", "BUSD", "USDT")
+        ],
+    }
+
+
+def fixture_signals(market):
+    class FixtureSignals(Signals):
+        # CoinGecko responses replaced by fixtures, cached the same way as the real calls
+        cgvalues = staticmethod(lru_cache(maxsize=None)(lambda rank: market))
+        cgexchanges = staticmethod(
+            lru_cache(maxsize=None)(lambda exchange, id: fixture_exchange(id))
+        )
+
+    return FixtureSignals(QuietLogger())
+
+
+def fixture_bots(prefix, count=330, market="USDT"):
+    rnd = random.Random(7)
+    bots = []
+    for i in range(count):
+        # mix of single bots and foreign bots not matching the single bot name
+        if i % 11 == 0:
+            name = "OTHER_BOT_" + str(i)
+        else:
+            name = prefix + "_" + market + "_TOK" + str(i) + "_dcabot"
+        active = rnd.choice([0, 0, 0, 1])
+        bots.append(
+            {
+                "id": 10000000 + i,
+                "name": name,
+                "pairs": [market + "_TOK" + str(i)],
+                "is_enabled": rnd.random() < 0.3,
+                "active_deals_count": active,
+                "max_active_deals": 1,
+                "finished_deals_profit_usd": "1.5",
+                "created_at": "2022-09-01T10:00:00.000Z",
+            }
+        )
+    return bots
+
+
+def fixture_candles(rows=72):
+    rnd = random.Random(3)
+    price = 20000.0
+    data = []
+    for i in range(rows):
+        price = price * (1 + rnd.uniform(-0.003, 0.003))
+        data.append([price, price * 1.001, price * 0.999, price, price, 1000.0])
+    return pd.DataFrame(
+        data,
+        columns=["Open", "High", "Low", "Close", "Adj Close", "Volume"],
+        index=pd.date_range("2022-09-24", periods=rows, freq="5min"),
+    )
+
+
+def signal_message(token, action="START"):
+    return "\n".join(
+        [
+            "🤖 3CQS signal",
+            "SymRank Top 100 Quadruple Tracker",
+            "#" + token,
+            "BOT_" + action,
+            "Volatility Score 3.21",
+            "Price Action Score 1.07",
+            "SymRank #12",
+        ]
+    )
+
+
+def symrank_message():
+    lines = ["SymRank Top 30"]
+    for i in range(1, 31, 2):
+        lines.append(
+            str(i) + ". TOK" + str(i) + "     " + str(i + 1) + ". TOK" + str(i + 1)
+        )
+    lines.append("")
+    return "\n".join(lines)
+
+
+def load_bot_script(namespace, functions):
+    # 3cqsbot.py connects to Telegram on import, so only lift its imports,
+    # asyncState initialisation and the requested functions
+    tree = ast.parse(BOT_SCRIPT.read_text(), filename=str(BOT_SCRIPT))
+    body = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            body.append(node)
+        elif (
+            isinstance(node, ast.Assign)
+            and isinstance(node.targets[0], (ast.Name, ast.Attribute))
+            and ast.unparse(node.targets[0]).split(".")[0] == "asyncState"
+        ):
+            body.append(node)
+        elif (
+            isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and node.name in functions
+        ):
+            # drop the Telethon event registration, keep e.g. tenacity decorators
+            node.decorator_list = [
+                decorator
+                for decorator in node.decorator_list
+                if not ast.unparse(decorator).startswith("client.")
+            ]
+            body.append(node)
+    exec(compile(ast.Module(body=body, type_ignores=[]), str(BOT_SCRIPT), "exec"), namespace)
+    return namespace
+
+
+######################################################
+#                     Benchmarks                     #
+######################################################
+
+
+def measure(func, repeat, number=None):
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    times = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "loops": number,
+        "repeat": repeat,
+        "best_us": round(min(times), 3),
+        "median_us": round(statistics.median(times), 3),
+        "mean_us": round(statistics.mean(times), 3),
+        "stdev_us": round(statistics.stdev(times), 3) if len(times) > 1 else 0.0,
+    }
+
+
+def single_counts(bot):
+    # bot lookups done by SingleBot.trigger and report_deals for each signal
+    bot.count_enabled_bots()
+    bot.count_active_deals()
+    bot.count_active_deals_disabled_bots()
+    bot.count_all_bots()
+    return bot.index_bots()["by_name"].get("3CQSBOT_MULTI_USDT_TOK5_dcabot")
+
+
+def build_benchmarks(workdir):
+    attributes = fixture_config(workdir)
+    namespace = load_bot_script(
+        {
+            "attributes": attributes,
+            "logging": QuietLogger(),
+            "datadir": workdir,
+            "program": "3cqsbot",
+        },
+        [
+            "parse_tg",
+            "tg_data",
+            "ema",
+            "btctechnical",
+            "report_funds_needed",
+            "get_deal_mode",
+            "bot_data",
+            "my_event_handler",
+            "handle_signal",
+            "signal_processed",
+            "remember_message",
+            "catch_up",
+            "first_live_message",
+            "process_deferred",
+            "flush_bot_updates",
+            "wait_for_budget",
+            "_handle_task_result",
+        ],
+    )
+    asyncState = namespace["asyncState"]
+
+    signal_text = signal_message("TOK5")
+    symrank_text = symrank_message()
+    fgi_values = [random.Random(1).randint(0, 100) for _ in range(100)]
+    candles = fixture_candles()
+    # btctechnical imports yfinance on first use
+    sys.modules["yfinance"] = type(
+        "yf", (), {"download": staticmethod(lambda **kw: candles.copy())}
+    )
+    market = fixture_market()
+    signals = fixture_signals(market)
+    symrank_pairs = ["TOK" + str(i) for i in range(1, 31)]
+    bots = fixture_bots(
+        attributes.get("prefix", "", "dcabot")
+        + "_"
+        + attributes.get("subprefix", "", "dcabot")
+    )
+    singlebot = SingleBot([], bots, {}, attributes, None, QuietLogger(), asyncState)
+    multibot = MultiBot([], [], {}, [], attributes, None, QuietLogger(), asyncState)
+
+    parse_tg = namespace["parse_tg"]
+    tg_data = namespace["tg_data"]
+    ema = namespace["ema"]
+
+    benchmarks = {
+        "tg_data.signal": lambda: tg_data(parse_tg(signal_text)),
+        "tg_data.symrank": lambda: tg_data(parse_tg(symrank_text)),
+        "config.get.section": lambda: attributes.get("bo", "", "dcabot"),
+        "config.get.search": lambda: attributes.get("market"),
+        "config.get.default": lambda: attributes.get("topcoin_limit", 3500),
+        "ema.fgi100": lambda: ema(fgi_values, 20),
+        "btctechnical.indicators": lambda: namespace["btctechnical"]("BTC-USD"),
+        "signals.topcoin.pair": lambda: signals.topcoin(
+            "USDT_TOK1200", 3500, 100, "binance", "USDT", False
+        ),
+        "signals.topcoin.symrank30": lambda: signals.topcoin(
+            symrank_pairs, 3500, 100, "binance", "USDT", False
+        ),
+        "report_funds_needed.module": lambda: namespace["report_funds_needed"]("dcabot"),
+        "report_funds_needed.multibot": lambda: multibot.report_funds_needed(
+            "dcabot", False
+        ),
+        "report_funds_needed.singlebot": lambda: singlebot.report_funds_needed(
+            "dcabot", False
+        ),
+        # a SingleBot is created per signal, so every signal starts without a bot index
+        "singlebot.trigger_counts": lambda: single_counts(
+            SingleBot([], bots, {}, attributes, None, QuietLogger(), asyncState)
+        ),
+    }
+
+    return benchmarks, namespace
+
+
+def event_handler_benchmark(namespace, repeat, events=200):
+    # End-to-end multibot signal handling against a stubbed 3Commas and Telegram
+    stub = Stub3Commas(pairs=500, bots=300, seed=1)
+    namespace["p3cw"] = StubP3cw(stub)
+    namespace["notification"] = QuietNotification()
+    asyncState = namespace["asyncState"]
+    asyncState.account_data = {"id": "31337", "market_code": "paper_trading"}
+    asyncState.pair_data = frozenset(stub.market_pairs)
+    asyncState.btc_downtrend = False
+    asyncState.receive_signals = True
+    handler = namespace["my_event_handler"]
+    texts = [signal_message("TOK" + str(i % 500)) for i in range(events)]
+    messages = [
+        type("Event", (), {"raw_text": text, "id": id})()
+        for id, text in enumerate(texts, 1)
+    ]
+
+    async def run_events():
+        # the same messages are sent again in every repeat
+        asyncState.last_message_id = 0
+        for event in messages:
+            await handler(event)
+            # include the bot update and deal report sent after each signal
+            while asyncState.update_flush:
+                await asyncio.sleep(0)
+
+    loop = asyncio.new_event_loop()
+    namespace["client"] = type("Client", (), {"loop": loop})()
+    try:
+        result = measure(lambda: loop.run_until_complete(run_events()), repeat, 1)
+    finally:
+        loop.close()
+
+    for key in ("best_us", "median_us", "mean_us", "stdev_us"):
+        result[key] = round(result[key] / events, 3)
+    result["loops"] = events
+    result["api_calls"] = dict(stub.stats)
+    return result
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "describe", "--always", "--dirty"],
+                cwd=Path(__file__).parent,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result["median_us"] / baseline[name]["median_us"]
+            print(
+                f"{name:48s} {baseline[name]['median_us']:12.2f}us -> "
+                f"{result['median_us']:12.2f}us  x{ratio:5.2f}",
+                file=sys.stderr,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the 3cqsbot hot paths")
+    parser.add_argument("-o", "--output", help="write JSON results to file", type=str)
+    parser.add_argument("-r", "--repeat", default=5, type=int)
+    parser.add_argument("-k", "--filter", default="", help="run matching benchmarks only")
+    parser.add_argument("-c", "--compare", help="JSON results of an older run", type=str)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks, namespace = build_benchmarks(workdir)
+        for name, func in benchmarks.items():
+            if args.filter in name:
+                results[name] = measure(func, args.repeat)
+        if args.filter in "my_event_handler.multibot_signal":
+            results["my_event_handler.multibot_signal"] = event_handler_benchmark(
+                namespace, args.repeat
+            )
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "unit": "microseconds per call",
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
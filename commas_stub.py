@@ -0,0 +1,440 @@
+"""Local stand-in for the 3Commas API used by 3cqsbot for load and latency testing."""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/public/api/ver1/"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def timestamp(dt=None):
+    return (dt or datetime.utcnow()).strftime(TIMESTAMP_FORMAT)
+
+
+class StubError(Exception):
+    """Error response in the format returned by 3Commas."""
+
+    def __init__(self, status, error, description, attributes=None):
+        super().__init__(description)
+        self.status = status
+        self.body = {
+            "error": error,
+            "error_description": description,
+            "error_attributes": attributes or {},
+            # py3cw formats API errors this way, 3cqsbot only reads "msg"
+            "msg": "Other error occurred: "
+            + error
+            + " "
+            + description
+            + " "
+            + str(attributes or {})
+            + ".",
+        }
+
+
+class Stub3Commas:
+    """In-memory 3Commas account state with latency, error and rate-limit injection."""
+
+    def __init__(
+        self,
+        account_name="Paper trading 123456",
+        market="USDT",
+        pairs=500,
+        blacklist=None,
+        bots=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        rate_limit=0,
+        deal_lifetime=0,
+        seed=None,
+    ):
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # requests per minute, 0 = unlimited
+        self.rate_limit = rate_limit
+        # seconds until an open deal is closed with profit, 0 = deals stay open
+        self.deal_lifetime = deal_lifetime
+        self.request_times = deque()
+        self.stats = {}
+
+        self.account = {
+            "id": 31337,
+            "name": account_name,
+            "market_code": "paper_trading",
+        }
+        self.market = market
+        self.market_pairs = [market + "_BTC", market + "_ETH"] + [
+            market + "_TOK" + str(i) for i in range(pairs)
+        ]
+        self.blacklist = list(blacklist or [])
+        self.bots = {}
+        self.deals = {}
+        self.next_bot_id = 10000000
+        self.next_deal_id = 1000000000
+
+        for i in range(bots):
+            pair = self.market_pairs[i % len(self.market_pairs)]
+            bot = self.new_bot(
+                {
+                    "name": "3CQSBOT_SINGLE_" + pair + "_dcabot",
+                    "pairs": pair,
+                    "max_active_deals": 1,
+                },
+                created_at=datetime.utcnow()
+                - timedelta(days=self.random.randint(1, 90)),
+            )
+            bot["is_enabled"] = self.random.random() < 0.3
+            bot["finished_deals_count"] = self.random.randint(0, 50)
+            bot["finished_deals_profit_usd"] = str(
+                round(bot["finished_deals_count"] * self.random.uniform(0.1, 0.5), 2)
+            )
+
+    ######################################################
+    #                  Request plumbing                  #
+    ######################################################
+
+    def inject(self):
+        # Simulate network latency, 3Commas rate limiting and server errors
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        now = time.monotonic()
+        with self.lock:
+            if self.rate_limit:
+                while self.request_times and now - self.request_times[0] > 60:
+                    self.request_times.popleft()
+                if len(self.request_times) >= self.rate_limit:
+                    self.count("rate_limited")
+                    raise StubError(
+                        429, "rate_limit", "Too many requests, please slow down"
+                    )
+                self.request_times.append(now)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.count("injected_errors")
+            raise StubError(500, "internal_error", "Injected server error")
+
+    def count(self, key):
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def dispatch(self, method, path, query, body):
+        route = path[len(API_PREFIX) :].strip("/").split("/")
+        self.count(method + " " + "/".join(r if not r.isdigit() else "{id}" for r in route))
+        self.inject()
+
+        with self.lock:
+            self.expire_deals()
+            params = dict(query)
+            params.update(body or {})
+
+            if route == ["accounts"] and method == "GET":
+                return [dict(self.account)]
+            if route == ["accounts", "market_pairs"] and method == "GET":
+                return list(self.market_pairs)
+            if route == ["bots"] and method == "GET":
+                return self.list_bots(params)
+            if route == ["bots", "pairs_black_list"] and method == "GET":
+                return {"pairs": list(self.blacklist)}
+            if route == ["bots", "create_bot"] and method == "POST":
+                return dict(self.new_bot(params))
+            if route == ["deals"] and method == "GET":
+                return self.list_deals(params)
+            if len(route) == 3 and route[0] == "bots" and route[1].isdigit():
+                bot = self.get_bot(int(route[1]))
+                action = route[2]
+                if action == "show" and method == "GET":
+                    return dict(bot)
+                if action == "update" and method == "PATCH":
+                    return self.update_bot(bot, params)
+                if action == "enable" and method == "POST":
+                    bot["is_enabled"] = True
+                    return dict(bot)
+                if action == "disable" and method == "POST":
+                    bot["is_enabled"] = False
+                    return dict(bot)
+                if action == "delete" and method == "POST":
+                    return self.delete_bot(bot)
+                if action == "start_new_deal" and method == "POST":
+                    return self.start_new_deal(bot, params.get("pair", ""))
+
+        raise StubError(404, "not_found", "Unknown endpoint " + method + " " + path)
+
+    ######################################################
+    #                   Bot endpoints                    #
+    ######################################################
+
+    def new_bot(self, params, created_at=None):
+        pairs = params.get("pairs", [])
+        if isinstance(pairs, str):
+            pairs = [pairs]
+        if not params.get("name") or not pairs:
+            raise StubError(
+                400,
+                "record_invalid",
+                "Invalid parameters",
+                {"name": ["can't be blank"], "pairs": ["can't be blank"]},
+            )
+
+        self.next_bot_id += 1
+        bot = {
+            "id": self.next_bot_id,
+            "account_id": self.account["id"],
+            "is_enabled": False,
+            "created_at": timestamp(created_at),
+            "updated_at": timestamp(),
+            "active_deals_count": 0,
+            "active_deals_usd_profit": "0.0",
+            "finished_deals_count": 0,
+            "finished_deals_profit_usd": "0.0",
+            "deletable?": True,
+        }
+        self.bots[bot["id"]] = bot
+        self.update_bot(bot, params)
+        return bot
+
+    def update_bot(self, bot, params):
+        for key, value in params.items():
+            if key == "pairs" and isinstance(value, str):
+                value = [value]
+            bot[key] = value
+        bot["max_active_deals"] = int(bot.get("max_active_deals", 1))
+        bot["updated_at"] = timestamp()
+        return dict(bot)
+
+    def get_bot(self, bot_id):
+        if bot_id not in self.bots:
+            raise StubError(404, "not_found", "Bot " + str(bot_id) + " not found")
+        return self.bots[bot_id]
+
+    def delete_bot(self, bot):
+        if bot["active_deals_count"] > 0:
+            raise StubError(
+                422, "record_invalid", "Bot has active deals", {"base": ["active deals"]}
+            )
+        del self.bots[bot["id"]]
+        return dict(bot)
+
+    def list_bots(self, params):
+        limit = int(params.get("limit", 50))
+        offset = int(params.get("offset", 0))
+        # 3Commas returns the newest bots first
+        bots = sorted(self.bots.values(), key=lambda bot: bot["id"], reverse=True)
+        return [dict(bot) for bot in bots[offset : offset + limit]]
+
+    ######################################################
+    #                   Deal endpoints                   #
+    ######################################################
+
+    def start_new_deal(self, bot, pair):
+        if pair not in bot["pairs"]:
+            raise StubError(
+                422,
+                "record_invalid",
+                "Invalid parameters",
+                {"pair": ["is not in the bot pair list"]},
+            )
+        if bot["active_deals_count"] >= bot["max_active_deals"]:
+            raise StubError(
+                422,
+                "record_invalid",
+                "Invalid parameters",
+                {"base": ["Max active deals reached"]},
+            )
+        same_pair = sum(
+            1
+            for deal in self.deals.values()
+            if deal["bot_id"] == bot["id"]
+            and deal["pair"] == pair
+            and not deal["finished?"]
+        )
+        if same_pair >= int(bot.get("allowed_deals_on_same_pair", 1)):
+            raise StubError(
+                422,
+                "record_invalid",
+                "Invalid parameters",
+                {"base": ["Another deal is already open for " + pair]},
+            )
+
+        self.next_deal_id += 1
+        volume = float(bot.get("base_order_volume", 10))
+        deal = {
+            "id": self.next_deal_id,
+            "bot_id": bot["id"],
+            "bot_name": bot["name"],
+            "pair": pair,
+            "created_at": timestamp(),
+            "finished?": False,
+            "base_order_volume": str(volume),
+            "bought_volume": None,
+            "actual_usd_profit": "0.0",
+            "actual_profit_percentage": "0.0",
+            "deal_has_error": False,
+        }
+        self.deals[deal["id"]] = deal
+        bot["active_deals_count"] += 1
+        return dict(deal)
+
+    def expire_deals(self):
+        # Close deals after deal_lifetime seconds and book the take profit
+        if not self.deal_lifetime:
+            return
+        now = datetime.utcnow()
+        for deal in self.deals.values():
+            if deal["finished?"]:
+                continue
+            age = now - datetime.strptime(deal["created_at"], TIMESTAMP_FORMAT)
+            if age.total_seconds() < self.deal_lifetime:
+                continue
+            deal["finished?"] = True
+            bot = self.bots.get(deal["bot_id"])
+            if bot:
+                profit = float(deal["base_order_volume"]) * float(
+                    bot.get("take_profit", 1.5)
+                ) / 100
+                bot["active_deals_count"] = max(bot["active_deals_count"] - 1, 0)
+                bot["finished_deals_count"] += 1
+                bot["finished_deals_profit_usd"] = str(
+                    round(float(bot["finished_deals_profit_usd"]) + profit, 2)
+                )
+
+    def list_deals(self, params):
+        limit = int(params.get("limit", 50))
+        deals = sorted(self.deals.values(), key=lambda deal: deal["id"], reverse=True)
+        if params.get("bot_id"):
+            deals = [deal for deal in deals if deal["bot_id"] == int(params["bot_id"])]
+        if params.get("scope") == "active":
+            deals = [deal for deal in deals if not deal["finished?"]]
+        elif params.get("scope") == "finished":
+            deals = [deal for deal in deals if deal["finished?"]]
+        return [dict(deal) for deal in deals[:limit]]
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    stub = None
+
+    def log_message(self, format, *args):
+        # Keep the console quiet during load tests
+        return
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "60")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_method(self, method):
+        url = urlparse(self.path)
+        query = {key: value[-1] for key, value in parse_qs(url.query).items()}
+        body = None
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                body = None
+
+        if url.path == "/stub/stats":
+            self.respond(200, dict(self.stub.stats))
+            return
+        if not url.path.startswith(API_PREFIX):
+            self.respond(404, StubError(404, "not_found", url.path).body)
+            return
+
+        try:
+            self.respond(200, self.stub.dispatch(method, url.path, query, body))
+        except StubError as err:
+            self.respond(err.status, err.body)
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_PATCH(self):
+        self.handle_method("PATCH")
+
+
+def serve(stub, host="127.0.0.1", port=8765):
+    handler = type("Handler", (StubRequestHandler,), {"stub": stub})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local 3Commas API stand-in for 3cqsbot load and latency tests. "
+        + "Point 3cqsbot to it with 'api_url = http://127.0.0.1:8765' in [commas]"
+    )
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--account-name", default="Paper trading 123456", type=str)
+    parser.add_argument("--market", default="USDT", type=str)
+    parser.add_argument("--pairs", default=500, type=int, help="market pairs to offer")
+    parser.add_argument(
+        "--blacklist", default="", type=str, help="comma separated blacklisted pairs"
+    )
+    parser.add_argument("--bots", default=0, type=int, help="single bots to seed")
+    parser.add_argument("--latency", default=0.0, type=float, help="seconds per call")
+    parser.add_argument("--jitter", default=0.0, type=float, help="max extra seconds")
+    parser.add_argument(
+        "--error-rate", default=0.0, type=float, help="share of calls failing with 500"
+    )
+    parser.add_argument(
+        "--rate-limit", default=0, type=int, help="calls per minute before 429 (0 = off)"
+    )
+    parser.add_argument(
+        "--deal-lifetime", default=0, type=int, help="seconds until deals close (0 = never)"
+    )
+    parser.add_argument("--seed", default=None, type=int)
+    args = parser.parse_args()
+
+    stub = Stub3Commas(
+        account_name=args.account_name,
+        market=args.market,
+        pairs=args.pairs,
+        blacklist=[pair for pair in args.blacklist.split(",") if pair],
+        bots=args.bots,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        deal_lifetime=args.deal_lifetime,
+        seed=args.seed,
+    )
+    server = serve(stub, args.host, args.port)
+    print(
+        "3Commas stand-in listening on http://"
+        + args.host
+        + ":"
+        + str(args.port)
+        + " (account '"
+        + args.account_name
+        + "', "
+        + str(len(stub.market_pairs))
+        + " pairs, "
+        + str(len(stub.bots))
+        + " bots)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
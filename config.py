@@ -6,6 +6,8 @@ class Config:
     def __init__(self, datadir, program):
         self.config = configparser.ConfigParser()
         self.dataset = self.config.read(f"{datadir}/{program}.ini")
+        if self.dataset == []:
+            self.dataset = self.config.read(f"{datadir}/config.ini")
         if self.dataset == []:
             self.dataset = self.config.read("config.ini")
         self.fixstrings = ["account_name", "prefix", "subprefix", "suffix"]
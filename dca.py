@@ -0,0 +1,78 @@
+"""DCA safety order math shared by single bot, multi bot and config reporting."""
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# Config attributes of a DCA section ([dcabot], [fgi_aggressive], ...) needed for the calculation
+DCA_PARAMETERS = ("tp", "bo", "so", "os", "ss", "sos", "mstc")
+
+DcaResult = namedtuple(
+    "DcaResult", ["funds_needed", "max_deviation", "required_change"]
+)
+
+
+def geometric_sum(ratio, count):
+    # 1 + r + r^2 + ... + r^(count-1), also valid for r == 1
+    ratio = np.asarray(ratio, dtype=float)
+    count = np.asarray(count, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        series = (np.power(ratio, count) - 1) / (ratio - 1)
+    return np.where(np.isclose(ratio, 1.0), count, series)
+
+
+def dca_grid(tp, bo, so, os, ss, sos, mstc):
+    """Evaluate any number of DCA settings at once.
+
+    All arguments are scalars or arrays broadcastable against each other, e.g.
+    a parameter grid from np.meshgrid. Returns a DcaResult of arrays with the
+    funds needed per deal (all safety orders filled), the covered max price
+    deviation in percent and the max required change in percent to reach TP.
+    """
+    tp, bo, so, os, ss, sos, mstc = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (tp, bo, so, os, ss, sos, mstc))
+    )
+    # the first safety order is always counted, as it was in the original loop
+    orders = np.maximum(np.floor(mstc), 1)
+
+    # closed forms for total volume and deviation of the last safety order
+    funds_needed = bo + so * geometric_sum(os, orders)
+    max_deviation = sos * geometric_sum(ss, orders)
+
+    # base currency bought by every safety order, summed up to each profile's mstc
+    k = np.arange(int(orders.max()) if orders.size else 1, dtype=float)
+    expand = (Ellipsis, np.newaxis)
+    so_volume = so[expand] * np.power(os[expand], k)
+    so_deviation = sos[expand] * geometric_sum(ss[expand], k + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        so_size = np.where(
+            k < orders[expand], so_volume / (1 - so_deviation / 100), 0.0
+        )
+    size_base = bo + so_size.sum(axis=-1)
+
+    average_price = funds_needed / size_base
+    required_price = average_price * (1 + tp / 100)
+    last_price = (100 - max_deviation) / 100
+    required_change = (required_price / last_price - 1) * 100
+
+    return DcaResult(funds_needed, max_deviation, required_change)
+
+
+@lru_cache(maxsize=None)
+def dca_funds(tp, bo, so, os, ss, sos, mstc):
+    # Memoized per DCA profile, the settings only change with a config or FGI switch
+    result = dca_grid(tp, bo, so, os, ss, sos, mstc)
+    return DcaResult(*(float(value) for value in result))
+
+
+def dca_profile(attributes, dca_conf):
+    return {
+        parameter: attributes.get(parameter, "", dca_conf)
+        for parameter in DCA_PARAMETERS
+    }
+
+
+@lru_cache(maxsize=None)
+def funds_needed(attributes, dca_conf):
+    # The config is not reloaded at runtime, so the result per DCA section never changes
+    return dca_funds(**dca_profile(attributes, dca_conf))
@@ -0,0 +1,246 @@
+"""Sweep DCA settings vectorized and rank them for a given number of concurrent deals."""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from config import Config
+from dca import DCA_PARAMETERS, dca_grid
+
+# Trade Alts Safer settings, same as the [dcabot] example configuration
+DEFAULT_PROFILE = {
+    "tp": 1.5,
+    "bo": 11,
+    "so": 11,
+    "os": 1.05,
+    "ss": 1,
+    "sos": 2.4,
+    "mstc": 25,
+    "mad": 10,
+    "single_count": 10,
+}
+
+SORT_KEYS = {
+    # column, descending
+    "deviation": ("max_deviation", True),
+    "change": ("required_change", False),
+    "capital": ("capital", False),
+}
+
+# evaluate the grid in chunks to keep memory usage flat for very large sweeps
+CHUNK_SIZE = 250000
+
+
+def parse_range(value, integer=False):
+    # "1.5" single value, "1,1.1,1.3" list or "1:1.5:0.05" range with inclusive end (step 1 if omitted)
+    if ":" in value:
+        parts = [float(part) for part in value.split(":")]
+        start, stop, step = parts if len(parts) == 3 else parts + [1.0]
+        values = np.arange(start, stop + step / 2, step)
+    else:
+        values = np.array([float(part) for part in value.split(",")])
+    if integer:
+        values = np.unique(np.round(values).astype(int))
+    return values
+
+
+def load_profile(datadir, section):
+    profile = dict(DEFAULT_PROFILE)
+    extra = {}
+    if not section:
+        return profile, extra
+
+    # same config lookup as 3cqsbot.py, a given section must exist
+    attributes = Config(datadir, "3cqsbot")
+    if not attributes.dataset:
+        sys.exit(
+            f"Cannot read {datadir}/3cqsbot.ini or config.ini for section ["
+            + section
+            + "]"
+        )
+    if not attributes.config.has_section(section):
+        sys.exit("Section [" + section + "] not found in " + attributes.dataset[0])
+    for parameter in profile:
+        profile[parameter] = attributes.get(parameter, profile[parameter], section)
+    # keep non-DCA settings such as prefix or deal_mode for the emitted section
+    for key, value in attributes.config[section].items():
+        if key not in DCA_PARAMETERS:
+            extra[key] = value
+    return profile, extra
+
+
+def sweep(grid, deals, chunk_size=CHUNK_SIZE):
+    mesh = np.meshgrid(*(grid[parameter] for parameter in DCA_PARAMETERS), indexing="ij")
+    columns = {
+        parameter: values.ravel() for parameter, values in zip(DCA_PARAMETERS, mesh)
+    }
+    results = {"funds_needed": [], "max_deviation": [], "required_change": []}
+    total = columns["tp"].size
+    for start in range(0, total, chunk_size):
+        chunk = {
+            parameter: values[start : start + chunk_size]
+            for parameter, values in columns.items()
+        }
+        result = dca_grid(**chunk)
+        for key in results:
+            results[key].append(result._asdict()[key])
+    for key in results:
+        columns[key] = np.concatenate(results[key])
+    columns["capital"] = columns["funds_needed"] * deals
+    return columns
+
+
+def rank(columns, sort, budget=0, min_deviation=0, max_deviation=90, max_change=0):
+    # safety orders close to a price of 0 are not useful
+    valid = columns["max_deviation"] <= max_deviation
+    if budget:
+        valid &= columns["capital"] <= budget
+    if min_deviation:
+        valid &= columns["max_deviation"] >= min_deviation
+    if max_change:
+        valid &= columns["required_change"] <= max_change
+    index = np.flatnonzero(valid)
+
+    # np.lexsort uses the last key as primary key
+    keys = []
+    for key in reversed(sort):
+        column, descending = SORT_KEYS[key]
+        values = columns[column][index]
+        keys.append(-values if descending else values)
+    return index[np.lexsort(keys)] if keys else index
+
+
+def format_value(parameter, value):
+    if parameter == "mstc":
+        return str(int(value))
+    return f"{value:.6g}"
+
+
+def emit_section(section, columns, i, deals, deals_key, extra):
+    lines = ["[" + section + "]"]
+    for key, value in extra.items():
+        if key != deals_key:
+            lines.append(key + " = " + value)
+    for parameter in DCA_PARAMETERS:
+        lines.append(parameter + " = " + format_value(parameter, columns[parameter][i]))
+    lines.append(deals_key + " = " + str(deals))
+    lines.append(
+        "### covering max price dev: "
+        + f"{columns['max_deviation'][i]:2.1f}"
+        + "% - max required change: "
+        + f"{columns['required_change'][i]:2.1f}"
+        + "% - total funds needed: $"
+        + f"{columns['capital'][i]:.2f}"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sweep DCA settings and rank them by covered max price deviation, "
+        + "required change and capital needed. Parameters accept a value, a list "
+        + "'1,1.1,1.2' or a range 'start:stop:step' (stop included)"
+    )
+    parser.add_argument("-d", "--datadir", help="data directory to use", type=str)
+    parser.add_argument(
+        "-s",
+        "--section",
+        help="DCA section to start from and to emit, e.g. dcabot or fgi_moderate",
+        type=str,
+        default="",
+    )
+    for parameter in DCA_PARAMETERS:
+        parser.add_argument("--" + parameter, type=str)
+    parser.add_argument(
+        "--deals", type=int, help="concurrent deals, mad or single_count (from config)"
+    )
+    parser.add_argument(
+        "--single", action="store_true", help="emit single_count instead of mad"
+    )
+    parser.add_argument("--budget", type=float, default=0, help="max capital in USD")
+    parser.add_argument("--min-deviation", type=float, default=0)
+    parser.add_argument("--max-deviation", type=float, default=90)
+    parser.add_argument("--max-change", type=float, default=0)
+    parser.add_argument(
+        "--sort",
+        type=str,
+        default="deviation,change,capital",
+        help="ranking order of " + ", ".join(SORT_KEYS),
+    )
+    parser.add_argument("-n", "--top", type=int, default=10)
+    parser.add_argument(
+        "--emit", action="store_true", help="print the best setting in config.ini format"
+    )
+    args = parser.parse_args()
+
+    datadir = args.datadir or os.getcwd()
+    profile, extra = load_profile(datadir, args.section)
+    deals_key = "single_count" if args.single else "mad"
+    deals = args.deals or int(profile[deals_key])
+
+    sort = [key.strip() for key in args.sort.split(",") if key.strip()]
+    for key in sort:
+        if key not in SORT_KEYS:
+            sys.exit("Unknown sort key '" + key + "'")
+
+    grid = {}
+    for parameter in DCA_PARAMETERS:
+        value = getattr(args, parameter)
+        if value:
+            grid[parameter] = parse_range(value, parameter == "mstc")
+        else:
+            grid[parameter] = np.array([profile[parameter]], dtype=float)
+
+    started = time.perf_counter()
+    columns = sweep(grid, deals)
+    order = rank(
+        columns,
+        sort,
+        args.budget,
+        args.min_deviation,
+        args.max_deviation,
+        args.max_change,
+    )
+    elapsed = time.perf_counter() - started
+
+    print(
+        str(columns["tp"].size)
+        + " DCA settings evaluated in "
+        + f"{elapsed:.2f}s"
+        + " - "
+        + str(order.size)
+        + " matching the limits for "
+        + str(deals)
+        + " concurrent deals",
+        file=sys.stderr,
+    )
+    if not order.size:
+        sys.exit(1)
+
+    if args.emit:
+        print(
+            emit_section(
+                args.section or "dcabot", columns, order[0], deals, deals_key, extra
+            )
+        )
+        return
+
+    header = "".join(f"{parameter:>8s}" for parameter in DCA_PARAMETERS)
+    print(header + f"{'max dev%':>10s}{'req chg%':>10s}{'funds/deal':>12s}{'capital':>12s}")
+    for i in order[: args.top]:
+        print(
+            "".join(
+                f"{format_value(parameter, columns[parameter][i]):>8s}"
+                for parameter in DCA_PARAMETERS
+            )
+            + f"{columns['max_deviation'][i]:10.1f}"
+            + f"{columns['required_change'][i]:10.1f}"
+            + f"{columns['funds_needed'][i]:12.2f}"
+            + f"{columns['capital'][i]:12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class DealTracker:
+    """Active deals of 3cqsbot with their totals, polled from 3Commas in the background.
+
+    Deals are parsed once when first seen and refreshed in place by later
+    polls, deals missing from a poll are finished and dropped. Deal reports
+    read this state instead of requesting the deals on the signal path.
+    """
+
+    def __init__(self):
+        # deal id -> parsed deal, newest deal first after each poll
+        self.deals = {}
+        self.updated_at = None
+        self.bought_volume = 0.0
+        self.upnl = 0.0
+
+    def __len__(self):
+        return len(self.deals)
+
+    def __iter__(self):
+        return iter(self.deals.values())
+
+    def store(self, deal):
+        known = self.deals.get(deal["id"])
+        if deal["bought_volume"] is None:
+            # if no bought_volume, then use base_order_volume for bought_volume
+            bought_volume = deal["base_order_volume"]
+        else:
+            bought_volume = deal["bought_volume"]
+        self.deals[deal["id"]] = {
+            "id": deal["id"],
+            "bot_id": deal["bot_id"],
+            "pair": deal["pair"],
+            "created_at": known["created_at"]
+            if known
+            else datetime.strptime(deal["created_at"], TIMESTAMP_FORMAT),
+            "bought_volume": float(bought_volume),
+            "actual_usd_profit": float(deal["actual_usd_profit"]),
+            "actual_profit_percentage": deal["actual_profit_percentage"],
+            "deal_has_error": deal["deal_has_error"],
+        }
+
+    def add(self, deal):
+        # Deal just started, e.g. returned by start_new_deal, until the next poll
+        self.store(deal)
+        self.deals = {deal["id"]: self.deals.pop(deal["id"]), **self.deals}
+        self.total()
+
+    def update(self, deals):
+        # Replace the tracked deals by the active deals of a poll
+        active = [deal for deal in deals if not deal.get("finished?")]
+        for deal in active:
+            self.store(deal)
+        ids = {deal["id"] for deal in active}
+        self.deals = {
+            id: deal
+            for id, deal in sorted(
+                self.deals.items(), key=lambda item: item[1]["created_at"], reverse=True
+            )
+            if id in ids
+        }
+        self.updated_at = datetime.utcnow()
+        self.total()
+
+    def total(self):
+        self.bought_volume = sum(deal["bought_volume"] for deal in self.deals.values())
+        self.upnl = sum(deal["actual_usd_profit"] for deal in self.deals.values())
+
+    def newest(self):
+        if not self.deals:
+            return None
+        return max(self.deals.values(), key=lambda deal: deal["created_at"])
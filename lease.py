@@ -0,0 +1,88 @@
+import sqlite3
+from time import monotonic, time
+
+
+class Lease:
+    """Leader lease shared by an active and a standby 3cqsbot through a SQLite file.
+
+    The holder renews the lease well before it expires, another instance can
+    only take it once it has expired. held() counts from the last renewal with
+    the local monotonic clock and ends before the lease expires, so a holder
+    that was stalled stops acting before the standby may take over.
+
+    Idempotency keys of deal starts are claimed in the same file, so the
+    instance taking over does not repeat deals of signals it replays.
+    """
+
+    def __init__(self, path, holder, duration=15, name="3cqsbot"):
+        self.path = path
+        self.holder = holder
+        self.duration = duration
+        self.name = name
+        self.valid_until = 0
+        self.db = sqlite3.connect(path, timeout=duration / 3, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, holder TEXT, expires REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS actions (key TEXT PRIMARY KEY, claimed REAL)"
+        )
+
+    def acquire(self):
+        # Take or renew the lease, True if this instance holds it now
+        started = monotonic()
+        now = time()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute(
+                "SELECT holder, expires FROM lease WHERE name = ?", (self.name,)
+            ).fetchone()
+            acquired = row is None or row[0] == self.holder or row[1] < now
+            if acquired:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO lease (name, holder, expires) VALUES (?, ?, ?)",
+                    (self.name, self.holder, now + self.duration),
+                )
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK")
+            acquired = False
+
+        if acquired:
+            self.valid_until = started + self.duration * 0.8
+        return acquired
+
+    def held(self):
+        return monotonic() < self.valid_until
+
+    def taken(self):
+        # True while another instance holds an unexpired lease
+        row = self.db.execute(
+            "SELECT holder, expires FROM lease WHERE name = ?", (self.name,)
+        ).fetchone()
+        return row is not None and row[0] != self.holder and row[1] >= time()
+
+    def release(self):
+        self.valid_until = 0
+        self.db.execute(
+            "DELETE FROM lease WHERE name = ? AND holder = ?", (self.name, self.holder)
+        )
+
+    def claim(self, key):
+        # True only for the first claim of an idempotency key by any instance
+        try:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO actions (key, claimed) VALUES (?, ?)",
+                (key, time()),
+            )
+        except sqlite3.Error:
+            return False
+        return cursor.rowcount == 1
+
+    def unclaim(self, key):
+        # The action failed, a later attempt may claim the key again
+        self.db.execute("DELETE FROM actions WHERE key = ?", (key,))
+
+    def prune(self, age=86400 * 7):
+        self.db.execute("DELETE FROM actions WHERE claimed < ?", (time() - age,))
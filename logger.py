@@ -9,8 +9,6 @@ import threading
 import time
 from logging.handlers import TimedRotatingFileHandler as _TimedRotatingFileHandler
 
-import apprise
-
 
 class NotificationHandler:
     """Notification class."""
@@ -20,6 +18,9 @@ class NotificationHandler:
         self.message = ""
 
         if enabled and notify_urls:
+            # apprise loads all of its notification plugins on import
+            import apprise
+
             self.apobj = apprise.Apprise()
             urls = json.loads(notify_urls)
             for url in urls:
@@ -131,9 +132,11 @@ class Logger:
         logstokeep,
         debug_enabled,
         notify_enabled,
+        name=None,
     ):
         """Logger init."""
-        self.my_logger = logging.getLogger()
+        # named loggers keep the logs of bots running in one process apart
+        self.my_logger = logging.getLogger(name)
         self.datadir = datadir
         self.program = program
         self.notify_enabled = notify_enabled
@@ -147,11 +150,12 @@ class Logger:
             self.my_logger.propagate = False
 
         date_fmt = "%Y-%m-%d %H:%M:%S"
+        label = name or program
         formatter = logging.Formatter(
-            f"%(asctime)s - {program} - %(levelname)s - %(message)s", date_fmt
+            f"%(asctime)s - {label} - %(levelname)s - %(message)s", date_fmt
         )
         console_formatter = logging.Formatter(
-            f"%(asctime)s - {program} - %(levelname)s - %(message)s", date_fmt
+            f"%(asctime)s - {label} - %(levelname)s - %(message)s", date_fmt
         )
         # Create directory if not exists
         if not os.path.exists(f"{self.datadir}/logs"):
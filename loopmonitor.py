@@ -0,0 +1,93 @@
+import asyncio
+import sys
+import threading
+import traceback
+from collections import deque
+from time import monotonic, sleep
+
+
+class LoopMonitor:
+    """Watchdog for stalls of the asyncio event loop.
+
+    A coroutine wakes up every interval seconds and measures how late the
+    loop scheduled it, the lag is kept for the metrics. A watcher thread
+    checks the heartbeat of the coroutine and logs the stack of the loop
+    thread once per stall when the loop did not run for threshold seconds,
+    which shows the call blocking the loop.
+    """
+
+    def __init__(self, logging, threshold=0.5, interval=0.25, samples=2000):
+        self.logging = logging
+        self.threshold = threshold
+        self.interval = interval
+        self.lags = deque(maxlen=samples)
+        self.heartbeat = monotonic()
+        self.loop_thread = None
+        self.counters = {"stalls": 0, "max_lag": 0.0, "stalled_time": 0.0}
+
+    async def run(self):
+        # started once, also if several bots share the process
+        if self.loop_thread:
+            return
+        loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = monotonic()
+        threading.Thread(target=self.watch, daemon=True).start()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.heartbeat = monotonic()
+            self.record(max(loop.time() - expected, 0))
+
+    def record(self, lag):
+        self.lags.append(lag)
+        self.counters["max_lag"] = max(self.counters["max_lag"], lag)
+        if lag >= self.threshold:
+            self.counters["stalls"] += 1
+            self.counters["stalled_time"] += lag
+            self.logging.warning("Event loop blocked for " + f"{lag:.2f}s", False)
+
+    def watch(self):
+        reported = False
+        while True:
+            sleep(self.threshold / 2)
+            blocked = monotonic() - self.heartbeat - self.interval
+            if blocked < self.threshold:
+                reported = False
+            elif not reported:
+                reported = True
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.logging.warning(
+                        "Event loop blocked for more than "
+                        + f"{blocked:.2f}"
+                        + "s in:\n"
+                        + "".join(traceback.format_stack(frame, limit=12)),
+                        False,
+                    )
+
+    def percentile(self, q):
+        if not self.lags:
+            return 0.0
+        lags = sorted(self.lags)
+        return lags[min(int(q * len(lags)), len(lags) - 1)]
+
+    def metrics(self):
+        return {
+            "p50": round(self.percentile(0.5), 3),
+            "p99": round(self.percentile(0.99), 3),
+            "max_lag": round(self.counters["max_lag"], 3),
+            "stalls": self.counters["stalls"],
+            "stalled_time": round(self.counters["stalled_time"], 1),
+        }
+
+
+MONITOR = None
+
+
+def loop_monitor(logging, **options):
+    # One monitor per process, bots running in one process share the loop
+    global MONITOR
+    if MONITOR is None:
+        MONITOR = LoopMonitor(logging, **options)
+    return MONITOR
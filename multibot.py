@@ -7,6 +7,8 @@ from datetime import datetime, timedelta
 from babel.dates import format_timedelta
 from babel.numbers import format_currency
 
+from dca import funds_needed
+from pairlist import PairList
 from signals import Signals
 
 
@@ -31,6 +33,8 @@ class MultiBot:
         self.logging = logging
         self.asyncState = asyncState
         self.signal = Signals(logging)
+        # set if an update was skipped and the bot data may hold outdated deal counters
+        self.stale = False
         self.config_botid = str(self.attributes.get("botid", "", "3commas"))
         self.botname = (
             self.attributes.get(
@@ -123,85 +127,50 @@ class MultiBot:
             True,
         )
 
+        deals = self.asyncState.deal_tracker
+        if deals.updated_at:
+            upnl = deals.upnl
+        else:
+            upnl = self.asyncState.multibot["active_deals_usd_profit"]
         self.logging.info(
-            "uPNL of active deals: "
-            + format_currency(
-                self.asyncState.multibot["active_deals_usd_profit"],
-                "USD",
-                locale="en_US",
-            ),
+            "uPNL of active deals: " + format_currency(upnl, "USD", locale="en_US"),
             True,
         )
 
-        error, data = self.p3cw.request(
-            entity="deals",
-            action="",
-            action_id="",
-            additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
-            payload={
-                "limit": 100,
-                "bot_id": self.asyncState.multibot["id"],
-                "scope": "active",
-            },
-        )
-        if error:
-            self.logging.error("function report_deals: " + error["msg"])
-        else:
-            i = 1
-            total_bought_volume = 0
-            for deals in data:
-
-                if i == 1 and report_latency:
-                    self.logging.info(
-                        "Time delta between 3cqs signal and actual deal creation: "
-                        + format_timedelta(
-                            datetime.strptime(
-                                deals["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                            )
-                            - self.asyncState.latest_signal_time,
-                            locale="en_US",
-                        ),
-                        True,
-                    )
-                i += 1
+        newest = deals.newest()
+        if report_latency and newest:
+            self.logging.info(
+                "Time delta between 3cqs signal and actual deal creation: "
+                + format_timedelta(
+                    newest["created_at"] - self.asyncState.latest_signal_time,
+                    locale="en_US",
+                ),
+                True,
+            )
 
-                if (
-                    deals["bought_volume"] == None
-                ):  # if no bought_volume, then use base_order_volume for bought_volume
-                    bought_volume = format_currency(
-                        deals["base_order_volume"], "USD", locale="en_US"
-                    )
-                    total_bought_volume += float(deals["base_order_volume"])
-                else:
-                    bought_volume = format_currency(
-                        deals["bought_volume"], "USD", locale="en_US"
-                    )
-                    total_bought_volume += float(deals["bought_volume"])
-                self.logging.info(
-                    "Deal "
-                    + deals["pair"]
-                    + " open since "
-                    + format_timedelta(
-                        datetime.utcnow()
-                        - datetime.strptime(
-                            deals["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                        ),
-                        locale="en_US",
-                    )
-                    + " - actual profit: "
-                    + format_currency(deals["actual_usd_profit"], "USD", locale="en_US")
-                    + " ("
-                    + deals["actual_profit_percentage"]
-                    + "%)"
-                    + " - bought volume: "
-                    + bought_volume
-                    + " - deal error: "
-                    + str(deals["deal_has_error"]),
-                    True,
+        for deal in deals:
+            self.logging.info(
+                "Deal "
+                + deal["pair"]
+                + " open since "
+                + format_timedelta(
+                    datetime.utcnow() - deal["created_at"], locale="en_US"
                 )
+                + " - actual profit: "
+                + format_currency(deal["actual_usd_profit"], "USD", locale="en_US")
+                + " ("
+                + deal["actual_profit_percentage"]
+                + "%)"
+                + " - bought volume: "
+                + format_currency(deal["bought_volume"], "USD", locale="en_US")
+                + " - deal error: "
+                + str(deal["deal_has_error"]),
+                True,
+            )
+        if deals.updated_at:
             self.logging.info(
                 "Total bought volume of all deals: "
-                + format_currency(total_bought_volume, "USD", locale="en_US"),
+                + format_currency(deals.bought_volume, "USD", locale="en_US"),
                 True,
             )
         return
@@ -220,31 +189,17 @@ class MultiBot:
                 True,
             )
 
-        tp = self.attributes.get("tp", "", dca_conf)
-        bo = self.attributes.get("bo", "", dca_conf)
-        so = self.attributes.get("so", "", dca_conf)
-        os = self.attributes.get("os", "", dca_conf)
-        ss = self.attributes.get("ss", "", dca_conf)
-        sos = self.attributes.get("sos", "", dca_conf)
-        mstc = self.attributes.get("mstc", "", dca_conf)
         mad = self.attributes.get("mad", "", dca_conf)
-
-        fundsneeded = bo + so
-        amount = so
-        pd = sos
-        cum_size_base = bo + so / (1 - (1 * sos / 100))
-        for i in range(mstc - 1):
-            amount = amount * os
-            fundsneeded += amount
-            pd = (pd * ss) + sos
-            price = (100 - pd) / 100
-            size_base = amount / price
-            cum_size_base += size_base
-            avg_price = fundsneeded / cum_size_base
-            required_price = avg_price * tp / 100 + avg_price
-            required_change = ((required_price / price) - 1) * 100
+        fundsneeded, pd, required_change = funds_needed(self.attributes, dca_conf)
 
         if report:
+            tp = self.attributes.get("tp", "", dca_conf)
+            bo = self.attributes.get("bo", "", dca_conf)
+            so = self.attributes.get("so", "", dca_conf)
+            os = self.attributes.get("os", "", dca_conf)
+            ss = self.attributes.get("ss", "", dca_conf)
+            sos = self.attributes.get("sos", "", dca_conf)
+            mstc = self.attributes.get("mstc", "", dca_conf)
             self.logging.info(
                 "Using DCA settings ["
                 + dca_conf
@@ -386,6 +341,30 @@ class MultiBot:
 
         return mad
 
+    def pair_limit(self):
+        # Pair list is only bounded with limit_inital_pairs for the volume ranked symrank list,
+        # not in signal mode. 3commas needs at least 2 pairs for a multibot
+        if (
+            self.attributes.get("limit_inital_pairs", False)
+            and self.attributes.get("topcoin_filter", False)
+            and self.get_deal_mode() != "signal"
+        ):
+            return max(self.attributes.get("mad"), 2)
+        return 0
+
+    def pair_list(self):
+        # Ordered set of the bot pairs, ranked by BTC volume for limit_inital_pairs
+        pairlist = self.asyncState.pairs_volume
+        pairlist.maxsize = self.pair_limit()
+        evicted = pairlist.sync(self.asyncState.multibot["pairs"])
+        if evicted:
+            self.logging.info(
+                "Removing " + str(evicted) + " - pair list limited to max active deals",
+                True,
+            )
+            self.asyncState.multibot["pairs"] = pairlist.pairs()
+        return pairlist
+
     def search_rename_3cqsbot(self):
 
         bot_by_id = False
@@ -428,15 +407,7 @@ class MultiBot:
                     mad = self.attributes.get("mad")
                     mad = self.adjust_mad(bot["pairs"], mad)
 
-                    error, data = self.p3cw.request(
-                        entity="bots",
-                        action="update",
-                        action_id=str(bot["id"]),
-                        additional_headers={
-                            "Forced-Mode": self.attributes.get("trade_mode")
-                        },
-                        payload=self.payload(bot["pairs"], mad, new_bot=False),
-                    )
+                    error, data = self.update(bot, bot["pairs"], mad)
 
                     if error:
                         self.logging.error(
@@ -486,15 +457,7 @@ class MultiBot:
                 mad = self.attributes.get("mad")
                 mad = self.adjust_mad(bot["pairs"], mad)
                 # always get a status update when searching first time for the bot
-                error, data = self.p3cw.request(
-                    entity="bots",
-                    action="update",
-                    action_id=str(bot["id"]),
-                    additional_headers={
-                        "Forced-Mode": self.attributes.get("trade_mode")
-                    },
-                    payload=self.payload(bot["pairs"], mad, new_bot=False),
-                )
+                error, data = self.update(bot, bot["pairs"], mad)
 
                 if error:
                     self.logging.error(
@@ -629,8 +592,8 @@ class MultiBot:
                 True,
             )
 
-    def new_deal(self, triggerpair):
-        # Triggers a new deal
+    def new_deal(self, triggerpair, signal_id=None):
+        # Triggers a new deal, once per pair of a signal even if the signal is replayed
         if triggerpair:
             pair = triggerpair
         else:
@@ -640,6 +603,17 @@ class MultiBot:
             else:
                 pair = ""
 
+        key = None
+        # claimed in the lease file if shared with a standby, which replays the signals after a takeover
+        claims = self.asyncState.lease or self.asyncState.signal_queue
+        if pair and signal_id and claims:
+            key = "start_new_deal:" + str(signal_id) + ":" + pair
+            if not claims.claim(key):
+                self.logging.info(
+                    "Deal for " + pair + " of this signal already triggered", True
+                )
+                return False
+
         if pair:
             error, data = self.p3cw.request(
                 entity="bots",
@@ -650,6 +624,10 @@ class MultiBot:
             )
 
             if error:
+                if key and self.asyncState.lease:
+                    self.asyncState.lease.unclaim(key)
+                elif key:
+                    self.asyncState.signal_queue.release(key)
                 self.logging.info(
                     "Triggering new deal for pair "
                     + pair
@@ -686,6 +664,7 @@ class MultiBot:
                     True,
                 )
                 self.asyncState.multibot["active_deals_count"] += 1
+                self.asyncState.deal_tracker.add(data)
                 return True
 
     def create(self):
@@ -716,6 +695,7 @@ class MultiBot:
 
         # Filter topcoins if set
         # if first_topcoin_call == true then CG API requests are processed with latency of 2.2sec to avoid API timeout erros
+        pairlist_volume = []
         if self.attributes.get("topcoin_filter", False):
             pairlist, pairlist_volume = self.signal.topcoin(
                 pairlist,
@@ -724,6 +704,7 @@ class MultiBot:
                 self.attributes.get("topcoin_exchange", "binance"),
                 self.attributes.get("market"),
                 self.asyncState.first_topcoin_call,
+                table=self.asyncState.topcoin_table,
             )
             if isinstance(pairlist, list):
                 self.asyncState.first_topcoin_call = False
@@ -778,13 +759,16 @@ class MultiBot:
                         + "'",
                         more_inform,
                     )
-            for pair in pairlist_volume:
-                market_pair = self.attributes.get("market") + "_" + pair[0]
-                if market_pair in self.pair_data:
-                    self.asyncState.pairs_volume.append(pair)
 
         self.logging.debug("Pairs after topcoin filter " + str(pairs))
 
+        # BTC volume of the symrank pairs for ranking later START signal pairs against them
+        if not dealmode_is_signal:
+            volumes = {
+                self.attributes.get("market") + "_" + coin: volume
+                for coin, volume in pairlist_volume
+            }
+
         # Run filters to adapt mad according to pair list - multibot creation with mad=1 possible
         if self.attributes.get("limit_inital_pairs", False):
             # Limit pairs to the maximal deals (mad)
@@ -795,12 +779,17 @@ class MultiBot:
             else:
                 maxpairs = len(pairs)
             pairs = pairs[0:maxpairs]
-            self.asyncState.pairs_volume = self.asyncState.pairs_volume[0:maxpairs]
             self.logging.info(
                 "Volume sorting and limiting symrank list to max active deals",
                 True,
             )
 
+        if not dealmode_is_signal:
+            self.asyncState.pairs_volume = PairList(
+                self.pair_limit(),
+                [(pair, volumes.get(pair)) for pair in pairs],
+            )
+
         # Adapt mad if pairs are under value
         mad = self.adjust_mad(pairs, mad)
         if not dealmode_is_signal:
@@ -851,6 +840,9 @@ class MultiBot:
                     sys.exit(-1)
             else:
                 self.asyncState.multibot = data
+                self.asyncState.bot_payloads.store(
+                    data["id"], self.payload(pairs, mad, new_bot=False)
+                )
                 if (
                     not self.attributes.get("ext_botswitch", False)
                     and not self.asyncState.btc_downtrend
@@ -864,8 +856,14 @@ class MultiBot:
                         True,
                     )
 
-                if dealmode_is_signal:
-                    successful_deal = self.new_deal(pair)
+                # signals missed while disconnected only create the bot, no deals
+                if self.asyncState.catching_up:
+                    self.logging.info("No deal started for a missed signal", True)
+                elif dealmode_is_signal:
+                    signal_id = (
+                        self.tg_data.get("id") if isinstance(self.tg_data, dict) else None
+                    )
+                    successful_deal = self.new_deal(pair, signal_id)
                 elif self.attributes.get("random_pair", "False"):
                     successful_deal = self.new_deal(triggerpair="")
 
@@ -881,13 +879,7 @@ class MultiBot:
             )
             maxfunds = self.report_funds_needed(self.asyncState.dca_conf)
 
-            error, data = self.p3cw.request(
-                entity="bots",
-                action="update",
-                action_id=str(self.asyncState.multibot["id"]),
-                additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
-                payload=self.payload(pairs, mad, new_bot=False),
-            )
+            error, data = self.update(self.asyncState.multibot, pairs, mad)
 
             if error:
                 self.logging.error("function create: " + error["msg"])
@@ -916,6 +908,7 @@ class MultiBot:
         more_inform = self.attributes.get("extensive_notifications", False)
         # Updates multi bot with new pairs
         pair = ""
+        listed = False
         mad = self.attributes.get("mad")
         dealmode_is_signal = self.get_deal_mode() == "signal"
 
@@ -952,6 +945,7 @@ class MultiBot:
                         self.attributes.get("topcoin_exchange", "binance"),
                         self.attributes.get("market"),
                         self.asyncState.first_topcoin_call,
+                        table=self.asyncState.topcoin_table,
                     )
                 else:
                     self.logging.info(
@@ -959,7 +953,9 @@ class MultiBot:
                     )
                 if pair:
                     self.asyncState.start_signals_topcoin_filter_passed_24h = +1
-                    if pair in self.asyncState.multibot["pairs"]:
+                    pairlist = self.pair_list()
+                    if pair in pairlist:
+                        listed = True
                         self.logging.info(
                             pair + " is already included in the pair list", more_inform
                         )
@@ -974,39 +970,42 @@ class MultiBot:
                         else:
                             self.logging.info("Adding " + pair, True)
 
-                        self.asyncState.multibot["pairs"].append(pair)
-
-                        # if limit_inital_pairs == True, add trigger pair to pairs_volume list and sort
-                        if (
-                            self.attributes.get("limit_inital_pairs", False)
-                            and self.asyncState.pairs_volume
-                        ):
-                            self.asyncState.pairs_volume.append(pair_volume)
-                            self.asyncState.pairs_volume = sorted(
-                                self.asyncState.pairs_volume,
-                                key=lambda x: x[1],
-                                reverse=True,
+                        # if limit_inital_pairs == True, pair with the lowest BTC volume drops out
+                        evicted = pairlist.add(
+                            pair,
+                            pair_volume[1]
+                            if self.attributes.get("topcoin_filter", False)
+                            else None,
+                        )
+                        if pair in evicted:
+                            self.logging.info(
+                                pair
+                                + " not added - BTC volume lower than the pairs of the limited pair list",
+                                True,
                             )
-                            self.asyncState.multibot["pairs"] = []
-                            for i in range(len(self.asyncState.pairs_volume)):
-                                self.asyncState.multibot["pairs"].append(
-                                    self.attributes.get("market")
-                                    + "_"
-                                    + self.asyncState.pairs_volume[i][0]
-                                )
+                        elif evicted:
+                            self.logging.info(
+                                "Removing "
+                                + str(evicted)
+                                + " - pair list limited to max active deals",
+                                True,
+                            )
+                        self.asyncState.multibot["pairs"] = pairlist.pairs()
 
             # do not remove pairs when deal_mode == "signal" to trigger deals faster when next START signal is received
             elif self.tg_data["action"] == "STOP":
 
                 if not dealmode_is_signal:
-                    if pair in self.asyncState.multibot["pairs"]:
+                    pairlist = self.pair_list()
+                    if pair in pairlist:
                         self.logging.info(
                             "STOP signal for "
                             + pair
                             + " received - removing from pair list",
                             True,
                         )
-                        self.asyncState.multibot["pairs"].remove(pair)
+                        pairlist.discard(pair)
+                        self.asyncState.multibot["pairs"] = pairlist.pairs()
                     else:
                         self.logging.info(
                             pair + " not removed because it was not in the pair list",
@@ -1022,21 +1021,28 @@ class MultiBot:
             if mad > mad_before:
                 self.logging.info("Adjusting mad to: " + str(mad), True)
 
-            # even with no pair, always update get an update of active / finished deals
-            error, data = self.p3cw.request(
-                entity="bots",
-                action="update",
-                action_id=str(self.asyncState.multibot["id"]),
-                additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
-                payload=self.payload(
-                    self.asyncState.multibot["pairs"], mad, new_bot=False
-                ),
-            )
+            # signals missed while disconnected only change the pair list, sent by flush()
+            if self.asyncState.catching_up:
+                self.asyncState.pending_updates += 1
+                return
 
-            if error:
-                self.logging.error("function trigger: " + error["msg"])
-            else:
-                self.asyncState.multibot = data
+            # fast path for pairs already in the list: start the deal first,
+            # bot update and deal report follow in flush()
+            if listed and dealmode_is_signal:
+                self.stale = True
+                self.asyncState.fast_path_deals_24h += 1
+                self.report_later(self.start_deal(pair, self.tg_data.get("id")))
+                return
+
+            # merge pair list changes of a signal burst into one update, sent by flush()
+            if self.attributes.get("update_window", 0):
+                self.asyncState.pending_updates += 1
+                if self.tg_data["action"] == "START" and pair and dealmode_is_signal:
+                    self.asyncState.pending_deals.append((pair, self.tg_data.get("id")))
+                return
+
+            # even with no pair, always update get an update of active / finished deals
+            self.update_pairs(mad)
 
             # avoid triggering a deal if STOP signal
             if self.tg_data["action"] == "STOP":
@@ -1045,17 +1051,74 @@ class MultiBot:
         # if random_only == true and deal_mode == "signal" then
         # initiate deal with a random coin (random_pair=true) from the filtered symrank pair list
         # if pair not empty and deal_mode == "signal" then initiate new deal
-        if (
-            (random_only or pair)
-            and dealmode_is_signal
-            and self.asyncState.multibot
-            and self.asyncState.bot_active
-        ):
+        if (random_only or pair) and dealmode_is_signal:
+            signal_id = None if random_only else self.tg_data.get("id")
+            self.report_later(self.start_deal(pair, signal_id))
+
+    def update(self, bot, pairs, mad):
+        # Push bot settings, skipped if identical to the last payload pushed for this bot
+        payload = self.payload(pairs, mad, new_bot=False)
+        if self.asyncState.bot_payloads.unchanged(bot["id"], payload):
+            self.logging.debug(
+                "Settings of botid " + str(bot["id"]) + " unchanged, skipping update"
+            )
+            self.stale = True
+            return {}, bot
+
+        error, data = self.p3cw.request(
+            entity="bots",
+            action="update",
+            action_id=str(bot["id"]),
+            additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
+            payload=payload,
+        )
+        if error:
+            self.asyncState.bot_payloads.forget(bot["id"])
+        else:
+            self.asyncState.bot_payloads.store(bot["id"], payload)
+            self.stale = False
+
+        return error, data
+
+    def update_pairs(self, mad):
+        error, data = self.update(
+            self.asyncState.multibot, self.asyncState.multibot["pairs"], mad
+        )
+
+        if error:
+            self.logging.error("function trigger: " + error["msg"])
+        else:
+            self.asyncState.multibot = data
+
+        return error
+
+    def refresh(self):
+        # Deal counters are only returned by 3commas on updates, fetch them if the update was skipped
+        error, data = self.p3cw.request(
+            entity="bots",
+            action="show",
+            action_id=str(self.asyncState.multibot["id"]),
+            additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
+        )
+
+        if error:
+            self.logging.error("function refresh: " + error["msg"])
+        else:
+            self.asyncState.multibot = data
+            self.stale = False
+
+    def start_deal(self, pair, signal_id=None):
+        if self.asyncState.multibot and self.asyncState.bot_active:
+            if self.stale and (
+                self.asyncState.multibot["active_deals_count"]
+                >= self.asyncState.multibot["max_active_deals"]
+            ):
+                self.refresh()
             if (
                 self.asyncState.multibot["active_deals_count"]
                 < self.asyncState.multibot["max_active_deals"]
             ):
-                successful_deal = self.new_deal(pair)
+                successful_deal = self.new_deal(pair, signal_id)
             else:
                 successful_deal = False
                 if self.asyncState.multibot["max_active_deals"] == self.attributes.get(
@@ -1070,4 +1133,60 @@ class MultiBot:
                         "Deal with this pair already active, not triggering a new one.",
                         True,
                     )
+            return successful_deal
+
+    def report_later(self, successful_deal):
+        # Deal report is sent by flush() after the signal has been handled
+        if successful_deal is not None:
+            self.asyncState.pending_report = (
+                bool(self.asyncState.pending_report) or successful_deal
+            )
+
+    def flush(self):
+        # Send the pair list changes collected since the last signal(s) in one update,
+        # then start the waiting deals and report them
+        updates = self.asyncState.pending_updates
+        deals = self.asyncState.pending_deals
+        self.asyncState.pending_updates = 0
+        self.asyncState.pending_deals = []
+        if not self.asyncState.multibot:
+            self.asyncState.pending_report = None
+            return
+
+        error = {}
+        updated = False
+        if updates:
+            mad = self.adjust_mad(
+                self.asyncState.multibot["pairs"], self.attributes.get("mad")
+            )
+            error = self.update_pairs(mad)
+            # not updated either if skipped as unchanged
+            updated = not error and not self.stale
+        # calls are only saved if the merged changes needed an update at all
+        if updated and updates > 1:
+            self.asyncState.bot_updates_saved_24h += updates - 1
+            self.logging.info(
+                str(updates)
+                + " pair list changes merged into one bot update - "
+                + str(updates - 1)
+                + " API call(s) saved",
+                self.attributes.get("extensive_notifications", False),
+            )
+
+        # the signal pairs may be missing in the bot, don't start deals on the old list
+        if error and deals:
+            self.logging.error(
+                str(len(deals))
+                + " deal(s) not started because the bot update failed: "
+                + ", ".join(pair for pair, signal_id in deals),
+                True,
+            )
+            deals = []
+
+        for pair, signal_id in deals:
+            self.report_later(self.start_deal(pair, signal_id))
+
+        successful_deal = self.asyncState.pending_report
+        self.asyncState.pending_report = None
+        if successful_deal is not None:
             self.report_deals(successful_deal)
@@ -0,0 +1,81 @@
+from bisect import bisect_left, insort
+
+
+class PairList:
+    """Ordered set of multibot pairs, ranked by BTC volume and capped to maxsize.
+
+    Pairs without volume rank below pairs with volume, newer pairs above older
+    ones with the same volume. When the list is full the lowest ranked pair is
+    evicted, which can be the pair just added.
+    """
+
+    def __init__(self, maxsize=0, pairs=()):
+        self.maxsize = maxsize
+        # pair -> rank key, in insertion order
+        self.entries = {}
+        # rank keys (-volume, -sequence, pair), best pair first
+        self.ranking = []
+        self.sequence = 0
+        for pair in pairs:
+            if isinstance(pair, tuple):
+                self.add(*pair)
+            else:
+                self.add(pair)
+
+    def __contains__(self, pair):
+        return pair in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def volume(self, pair):
+        key = self.entries.get(pair)
+        return -key[0] if key and key[0] else None
+
+    def add(self, pair, volume=None):
+        # Returns the evicted pairs, empty if the list was not full
+        if pair in self.entries:
+            if volume is None or volume == self.volume(pair):
+                return []
+            self.discard(pair)
+
+        self.sequence += 1
+        key = (-float(volume or 0), -self.sequence, pair)
+        insort(self.ranking, key)
+        self.entries[pair] = key
+
+        return self.shrink()
+
+    def discard(self, pair):
+        key = self.entries.pop(pair, None)
+        if key:
+            del self.ranking[bisect_left(self.ranking, key)]
+
+    def shrink(self):
+        evicted = []
+        while self.maxsize and len(self.ranking) > self.maxsize:
+            key = self.ranking.pop()
+            del self.entries[key[2]]
+            evicted.append(key[2])
+        return evicted
+
+    def sync(self, pairs):
+        # Align with the pair list returned by 3Commas, keeping the known volumes
+        evicted = []
+        if self.entries.keys() != set(pairs):
+            current = set(pairs)
+            for pair in [pair for pair in self.entries if pair not in current]:
+                self.discard(pair)
+            for pair in pairs:
+                if pair not in self.entries:
+                    evicted += self.add(pair)
+        return evicted + self.shrink()
+
+    def pairs(self):
+        return list(self.entries)
+
+    def ranked(self):
+        return [key[2] for key in self.ranking]
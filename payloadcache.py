@@ -0,0 +1,29 @@
+import hashlib
+import json
+
+
+def fingerprint(payload):
+    # Stable over key order, payloads only hold config values and pair lists
+    return hashlib.blake2b(
+        json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=16
+    ).hexdigest()
+
+
+class PayloadCache:
+    """Fingerprints of the bot payloads last pushed to 3Commas, by botid."""
+
+    def __init__(self):
+        self.fingerprints = {}
+        self.skipped = 0
+
+    def unchanged(self, botid, payload):
+        if self.fingerprints.get(str(botid)) == fingerprint(payload):
+            self.skipped += 1
+            return True
+        return False
+
+    def store(self, botid, payload):
+        self.fingerprints[str(botid)] = fingerprint(payload)
+
+    def forget(self, botid):
+        self.fingerprints.pop(str(botid), None)
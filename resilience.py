@@ -0,0 +1,335 @@
+"""Circuit breakers, adaptive timeouts and retry budgets for the outbound API calls."""
+import logging
+import threading
+from collections import deque
+from time import monotonic, sleep
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(IOError):
+    pass
+
+
+class Endpoint:
+    """Circuit breaker of one API with latency based timeout and retry budget.
+
+    The timeout follows the p99 of the recent latencies (times timeout_factor,
+    within min_timeout and max_timeout). After failure_threshold consecutive
+    failures the circuit opens and calls fail fast for cooldown seconds, then a
+    single trial call decides whether it closes again, other calls keep failing
+    fast until the trial returns. Retries draw from a
+    budget refilled by retry_ratio per successful call, so a degraded API is
+    not hammered by every caller at once.
+    """
+
+    def __init__(
+        self,
+        name,
+        timeout=10,
+        min_timeout=1,
+        max_timeout=30,
+        timeout_factor=3,
+        failure_threshold=5,
+        cooldown=60,
+        retries=2,
+        backoff=1,
+        retry_ratio=0.1,
+        retry_budget=10,
+        window=200,
+    ):
+        self.name = name
+        self.default_timeout = timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_ratio = retry_ratio
+        self.retry_budget = retry_budget
+        self.retry_tokens = float(retry_budget)
+        self.latencies = deque(maxlen=window)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        # trial call of the half open circuit in progress, calls may come from threads
+        self.probing = False
+        self.lock = threading.Lock()
+        # last good result and its time per key, returned while the API is unavailable
+        self.cache = {}
+        self.counters = dict.fromkeys(
+            ("calls", "failed", "rejected", "retried", "fallbacks", "opened"), 0
+        )
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def timeout(self):
+        # configured timeout until there are enough samples
+        if len(self.latencies) < 20:
+            return self.default_timeout
+        return min(
+            max(self.percentile(0.99) * self.timeout_factor, self.min_timeout),
+            self.max_timeout,
+        )
+
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN:
+                if monotonic() - self.opened_at < self.cooldown:
+                    self.counters["rejected"] += 1
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.counters["rejected"] += 1
+                    return False
+                self.probing = True
+            return True
+
+    def success(self, latency):
+        self.counters["calls"] += 1
+        self.latencies.append(latency)
+        self.failures = 0
+        self.probing = False
+        self.retry_tokens = min(self.retry_tokens + self.retry_ratio, self.retry_budget)
+        if self.state != CLOSED:
+            logger.warning(self.name + " API available again - circuit closed")
+            self.state = CLOSED
+
+    def failure(self, error=""):
+        self.counters["calls"] += 1
+        self.counters["failed"] += 1
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or (
+            self.state == CLOSED and self.failures >= self.failure_threshold
+        ):
+            self.state = OPEN
+            self.opened_at = monotonic()
+            self.counters["opened"] += 1
+            logger.warning(
+                self.name
+                + " API failing ("
+                + str(error)
+                + ") - circuit open for "
+                + str(self.cooldown)
+                + "s"
+            )
+
+    def call(self, func, key=None, max_age=0, fallback_age=0):
+        """Run func(timeout), retry within the budget and fall back to the cached result.
+
+        A cached result younger than max_age seconds is returned without a
+        call, so bots running in one process share the market data. With
+        fallback_age, older cached results are not used as fallback and the
+        error is raised instead.
+        """
+        if max_age and key in self.cache and monotonic() - self.cache[key][0] < max_age:
+            return self.cache[key][1]
+
+        if not self.allow():
+            return self.fallback(
+                key,
+                CircuitOpenError(self.name + " API unavailable - circuit open"),
+                fallback_age,
+            )
+
+        attempt = 0
+        while True:
+            started = monotonic()
+            try:
+                result = func(self.timeout())
+            except Exception as err:
+                self.failure(err)
+                if self.state == CLOSED and attempt < self.retries and self.retry_tokens >= 1:
+                    self.retry_tokens -= 1
+                    self.counters["retried"] += 1
+                    attempt += 1
+                    sleep(self.backoff * 2 ** (attempt - 1))
+                    continue
+                return self.fallback(key, err, fallback_age)
+
+            self.success(monotonic() - started)
+            if key is not None:
+                self.cache[key] = (monotonic(), result)
+            return result
+
+    def fallback(self, key, error, max_age=0):
+        if key is not None and key in self.cache:
+            cached_at, result = self.cache[key]
+            if not max_age or monotonic() - cached_at < max_age:
+                self.counters["fallbacks"] += 1
+                return result
+        if isinstance(error, IOError):
+            raise error
+        raise IOError(self.name + " API error: " + str(error)) from error
+
+    def metrics(self):
+        return {
+            "state": self.state,
+            "timeout": round(self.timeout(), 3),
+            "p50": round(self.percentile(0.5), 3),
+            "p99": round(self.percentile(0.99), 3),
+            "retry_tokens": round(self.retry_tokens, 1),
+            **self.counters,
+        }
+
+
+# Priority classes of 3Commas requests, lower is more important
+DEAL = 0
+SWITCH = 1
+UPDATE = 2
+REPORT = 3
+
+PRIORITY_NAMES = ("deal", "switch", "update", "report")
+
+PRIORITIES = {
+    ("bots", "start_new_deal"): DEAL,
+    ("bots", "enable"): SWITCH,
+    ("bots", "disable"): SWITCH,
+    ("deals", ""): REPORT,
+    ("accounts", "market_pairs"): REPORT,
+    ("bots", "pairs_black_list"): REPORT,
+}
+
+# share of the bucket kept free for the more important requests
+RESERVES = (0, 0.1, 0.25, 0.5)
+
+
+class RequestBudget:
+    """Token bucket for the 3Commas rate limit with priority reserves.
+
+    The bucket holds rate_limit tokens and refills rate_limit tokens per
+    minute. Only reporting requests are deferred when the tokens above their
+    reserve are used up, all other requests are always sent, so callers that
+    treat errors as fatal never see a deferral. Coroutines switching or
+    updating bots can await wait() first, which lets the more important
+    requests go first for up to max_wait seconds without blocking the loop.
+    """
+
+    def __init__(self, rate_limit, max_wait=5):
+        self.capacity = float(rate_limit)
+        self.rate = rate_limit / 60
+        self.max_wait = max_wait
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.counters = {
+            name: {"sent": 0, "waited": 0, "deferred": 0} for name in PRIORITY_NAMES
+        }
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.capacity)
+        self.updated = now
+
+    def acquire(self, priority):
+        # False only for a reporting request without tokens above its reserve
+        counters = self.counters[PRIORITY_NAMES[priority]]
+        self.refill()
+        if priority == REPORT and self.tokens < RESERVES[REPORT] * self.capacity + 1:
+            counters["deferred"] += 1
+            return False
+        self.tokens = max(self.tokens - 1, -self.capacity)
+        counters["sent"] += 1
+        return True
+
+    def wait(self, priority):
+        # Seconds until a request of this class fits above its reserve, at most max_wait
+        self.refill()
+        needed = RESERVES[priority] * self.capacity + 1
+        if self.tokens >= needed:
+            return 0
+        self.counters[PRIORITY_NAMES[priority]]["waited"] += 1
+        return min((needed - self.tokens) / self.rate, self.max_wait)
+
+    def exhausted(self):
+        # 3Commas answered with 429, back off until the bucket refilled
+        self.tokens = min(self.tokens, 0)
+        self.updated = monotonic()
+
+
+ENDPOINTS = {}
+
+
+def endpoint(name, **options):
+    # One shared breaker per API, options only apply when it is created
+    if name not in ENDPOINTS:
+        ENDPOINTS[name] = Endpoint(name, **options)
+    return ENDPOINTS[name]
+
+
+def metrics():
+    return {name: endpoint.metrics() for name, endpoint in ENDPOINTS.items()}
+
+
+class GuardedPy3CW:
+    """Py3CW wrapper adding circuit breaker, adaptive timeout and rate limit budget.
+
+    Py3CW keeps handling its own retries. Errors are returned in the same
+    format as Py3CW does, so callers can keep reading error["msg"].
+    """
+
+    def __init__(self, p3cw, endpoint, budget=None):
+        self.p3cw = p3cw
+        self.endpoint = endpoint
+        self.budget = budget
+
+    def request(
+        self,
+        entity,
+        action="",
+        action_id=None,
+        action_sub_id=None,
+        payload=None,
+        additional_headers=None,
+    ):
+        if self.budget and not self.budget.acquire(
+            PRIORITIES.get((entity, action), UPDATE)
+        ):
+            return {
+                "error": True,
+                "msg": "Other error occurred: 3commas rate limit budget low, request deferred",
+                "status_code": 429,
+            }, {}
+
+        # checked last, an allowed trial call of the half open circuit is always sent
+        if not self.endpoint.allow():
+            return {
+                "error": True,
+                "msg": "Other error occurred: 3commas circuit open, request not sent",
+                "status_code": None,
+            }, {}
+
+        self.p3cw.request_timeout = self.endpoint.timeout()
+        started = monotonic()
+        try:
+            error, data = self.p3cw.request(
+                entity=entity,
+                action=action,
+                action_id=action_id,
+                action_sub_id=action_sub_id,
+                payload=payload,
+                additional_headers=additional_headers,
+            )
+        except Exception as err:
+            self.endpoint.failure(err)
+            raise
+        # API errors like a deal already open for the pair are answers, not failures
+        status_code = error.get("status_code") if error else None
+        if status_code == 429 and self.budget:
+            self.budget.exhausted()
+        if error and (not status_code or status_code >= 500):
+            self.endpoint.failure(error.get("msg", ""))
+        else:
+            self.endpoint.success(monotonic() - started)
+        return error, data
@@ -0,0 +1,79 @@
+import sqlite3
+from time import time
+
+PENDING = "pending"
+DONE = "done"
+EXPIRED = "expired"
+
+
+class SignalQueue:
+    """Write-ahead log of the received Telegram messages, keyed by message id.
+
+    A message is stored before it is processed and marked done afterwards, so
+    messages interrupted by a crash can be replayed on the next start while
+    they are younger than max_age seconds. Repeated deliveries of a message
+    are recognised by its id. Idempotency keys of actions with side effects,
+    like deal starts, are claimed once, so a replay does not repeat them.
+    """
+
+    def __init__(self, path, max_age=300):
+        self.max_age = max_age
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS signals "
+            "(id INTEGER PRIMARY KEY, date REAL, raw_text TEXT, state TEXT, updated REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS actions (key TEXT PRIMARY KEY, claimed REAL)"
+        )
+
+    def add(self, id, date, raw_text):
+        # False if the message was received before
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO signals (id, date, raw_text, state, updated) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (id, date, raw_text, PENDING, time()),
+        )
+        return cursor.rowcount == 1
+
+    def done(self, *ids):
+        self.db.executemany(
+            "UPDATE signals SET state = ?, updated = ? WHERE id = ?",
+            [(DONE, time(), id) for id in ids],
+        )
+
+    def replay(self):
+        # Unprocessed messages in order of arrival, older ones are expired
+        self.db.execute(
+            "UPDATE signals SET state = ?, updated = ? WHERE state = ? AND date < ?",
+            (EXPIRED, time(), PENDING, time() - self.max_age),
+        )
+        return self.db.execute(
+            "SELECT id, date, raw_text FROM signals WHERE state = ? ORDER BY id",
+            (PENDING,),
+        ).fetchall()
+
+    def expired(self):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM signals WHERE state = ?", (EXPIRED,)
+        ).fetchone()[0]
+
+    def claim(self, key):
+        # True only for the first claim of an idempotency key
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO actions (key, claimed) VALUES (?, ?)", (key, time())
+        )
+        return cursor.rowcount == 1
+
+    def release(self, key):
+        # The action failed, a later attempt may claim the key again
+        self.db.execute("DELETE FROM actions WHERE key = ?", (key,))
+
+    def prune(self, age=86400 * 7):
+        before = time() - age
+        self.db.execute(
+            "DELETE FROM signals WHERE state != ? AND updated < ?", (PENDING, before)
+        )
+        self.db.execute("DELETE FROM actions WHERE claimed < ?", (before,))
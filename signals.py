@@ -1,12 +1,46 @@
 import math
 import re
 from functools import lru_cache, wraps
-from time import monotonic_ns, sleep
+from time import monotonic_ns, sleep, time
 
 from babel.numbers import format_currency
 from dateutil.relativedelta import relativedelta as rd
-from pycoingecko import CoinGeckoAPI
-from tenacity import retry, wait_fixed
+
+from resilience import endpoint
+
+# shared by all CoinGecko requests, so one failing request type opens the circuit for all
+coingecko = endpoint("coingecko", timeout=30, max_timeout=60)
+
+
+class TopcoinTable:
+    """Topcoin filter decision per pair, evaluated in the background.
+
+    Entries are (passed, volume_btc, evaluated_at) and only valid for the
+    filter settings (rank, volume, exchange, market) they were evaluated with.
+    """
+
+    def __init__(self, max_age=10800):
+        self.entries = {}
+        self.settings = None
+        self.max_age = max_age
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, pair, settings, passed, volume_btc):
+        if settings != self.settings:
+            self.entries = {}
+            self.settings = settings
+        self.entries[pair] = (passed, volume_btc, time())
+
+    def lookup(self, pair, settings):
+        # None if the pair was not evaluated yet, with other settings or too long ago
+        if settings != self.settings:
+            return None
+        entry = self.entries.get(pair)
+        if entry and time() - entry[2] <= self.max_age:
+            return entry
+        return None
 
 
 class Signals:
@@ -50,41 +84,55 @@ class Signals:
 
     @staticmethod
     @timed_lru_cache(seconds=10800, maxsize=None)
-    @retry(wait=wait_fixed(5))
     def cgexchanges(exchange, id):
+        from pycoingecko import CoinGeckoAPI
+
         cg = CoinGeckoAPI()
-        try:
-            exchange = cg.get_exchanges_tickers_by_id(id=exchange, coin_ids=id)
-        except Exception as e:
-            raise IOError("Coingecko API error:" + e)
-        return exchange
+
+        def tickers(timeout):
+            cg.request_timeout = timeout
+            return cg.get_exchanges_tickers_by_id(id=exchange, coin_ids=id)
+
+        return coingecko.call(tickers, key=("exchanges", exchange, id))
 
     @staticmethod
     @timed_lru_cache(seconds=10800, maxsize=None)
     def cgvalues(rank):
+        from pycoingecko import CoinGeckoAPI
+
         cg = CoinGeckoAPI()
-        market = []
 
         if rank <= 250:
             pages = 1
         else:
             pages = math.ceil(rank / 250)
 
-        for page in range(1, pages + 1):
-            page = cg.get_coins_markets(vs_currency="usd", page=page, per_page=250)
-            for entry in page:
-                market.append(entry)
+        def markets(timeout):
+            cg.request_timeout = timeout
+            market = []
+            for page in range(1, pages + 1):
+                page = cg.get_coins_markets(vs_currency="usd", page=page, per_page=250)
+                for entry in page:
+                    market.append(entry)
+            return market
 
-        return market
+        return coingecko.call(markets, key=("markets", rank))
 
-    def topvolume(self, id, volume, exchange, market):
-        # Check if topcoin has enough volume
+    def topvolume(self, id, volume, exchange, market, report=True, strict=False):
+        # Check if topcoin has enough volume, with strict an unavailable CoinGecko raises IOError
+        info = self.logging.info if report else self.logging.debug
 
         volume_btc = 0
         if volume > 0:
             volume_target = False
 
-            exchange = self.cgexchanges(exchange, id)
+            try:
+                exchange = self.cgexchanges(exchange, id)
+            except IOError as err:
+                if strict:
+                    raise
+                self.logging.error("Topcoin volume check of " + id + " failed: " + str(err))
+                return False, 0
 
             self.logging.debug(self.cgexchanges.cache_info())
 
@@ -112,7 +160,7 @@ class Signals:
                 ):
                     volume_target = True
                     volume_btc = target["converted_volume"]["btc"]
-                    self.logging.info(
+                    info(
                         market
                         + "_"
                         + str(target["base"])
@@ -134,7 +182,7 @@ class Signals:
                 ):
                     volume_target = False
                     volume_btc = target["converted_volume"]["btc"]
-                    self.logging.info(
+                    info(
                         market
                         + "_"
                         + str(target["base"])
@@ -156,7 +204,7 @@ class Signals:
 
             if volume_btc == 0:
                 if exchange["tickers"]:
-                    self.logging.info(
+                    info(
                         market
                         + "_"
                         + target["base"]
@@ -164,15 +212,58 @@ class Signals:
                         + exchange["name"]
                     )
                 else:
-                    self.logging.info("Pair is not traded on " + exchange["name"])
+                    info("Pair is not traded on " + exchange["name"])
         else:
             volume_target = True
 
         return volume_target, volume_btc
 
-    def topcoin(self, pairs, rank, volume, exchange, trademarket, first_time):
+    def market_index(self, rank):
+        # CG market entries by lower case symbol, best ranked first
+        index = {}
+        for symbol in self.cgvalues(rank):
+            index.setdefault(symbol["symbol"], []).append(symbol)
+        return index
+
+    def topcoin_decision(self, coin, index, rank, volume, exchange, trademarket):
+        # Topcoin filter of a single coin, same decision as topcoin() without reporting.
+        # Raises IOError if the volume could not be checked, there is no decision then
+        for symbol in index.get(coin.lower(), []):
+            if symbol["market_cap_rank"] and int(symbol["market_cap_rank"]) <= rank:
+                enough_volume, volume_btc = self.topvolume(
+                    symbol["id"], volume, exchange, trademarket, False, True
+                )
+                if enough_volume:
+                    return True, volume_btc
+        return False, 0
 
-        market = self.cgvalues(rank)
+    def topcoin(
+        self, pairs, rank, volume, exchange, trademarket, first_time, table=None
+    ):
+
+        # Pre-evaluated decision of a single signal pair, see TopcoinTable
+        if table is not None and not isinstance(pairs, list):
+            decision = table.lookup(pairs, (rank, volume, exchange, trademarket))
+            if decision:
+                passed, volume_btc, evaluated_at = decision
+                if passed:
+                    self.logging.info(
+                        str(pairs)
+                        + " matching top coin filter criteria (daily BTC volume: "
+                        + str(volume_btc)
+                        + ")"
+                    )
+                    return pairs, tuple([pairs.split("_", 1)[1], volume_btc])
+                self.logging.info(
+                    str(pairs) + " not matching the topcoin filter criteria"
+                )
+                return "", []
+
+        try:
+            market = self.cgvalues(rank)
+        except IOError as err:
+            self.logging.error("Topcoin filter failed: " + str(err))
+            market = []
 
         self.logging.debug(self.cgvalues.cache_info())
         self.logging.info(
@@ -7,6 +7,7 @@ from babel.dates import format_timedelta
 from babel.numbers import format_currency
 from pytz import UTC
 
+from dca import funds_needed
 from signals import Signals
 
 
@@ -35,59 +36,64 @@ class SingleBot:
             + "_"
             + self.suffix
         )
+        self.bot_pattern = re.compile(self.bot_name)
+        self.bot_index = None
+
+    def index_bots(self):
+        # One pass over all bots: counts of the single bots matching the configured name
+        # and an exact name index of all bots, rebuilt only after bot_data has changed
+        if self.bot_index is None:
+            index = {
+                "all": [],
+                "enabled": [],
+                "active": [],
+                "disabled_active": [],
+                "active_deals": 0,
+                "by_name": {},
+            }
+            for bot in self.bot_data:
+                index["by_name"].setdefault(bot["name"], bot)
+                if not self.bot_pattern.search(bot["name"]):
+                    continue
+                index["all"].append(bot)
+                if bot["is_enabled"]:
+                    index["enabled"].append(bot)
+                active_deals = int(bot["active_deals_count"])
+                index["active_deals"] += active_deals
+                if active_deals > 0:
+                    index["active"].append(bot)
+                    if not bot["is_enabled"]:
+                        index["disabled_active"].append(bot)
+            self.bot_index = index
+
+        return self.bot_index
 
     def count_active_deals(self):
-        #        account = self.account_data
-        deals = 0
-        bots = []
-
-        for bot in self.bot_data:
-            if re.search(self.bot_name, bot["name"]):
-                deals += int(bot["active_deals_count"])
-                if int(bot["active_deals_count"]) > 0:
-                    bots.append(bot)
+        index = self.index_bots()
 
         self.logging.debug(
-            "Active deals of single bots (enabled and disabled): " + str(deals)
+            "Active deals of single bots (enabled and disabled): "
+            + str(index["active_deals"])
         )
 
-        return deals, bots
+        return index["active_deals"], index["active"]
 
     def count_active_deals_disabled_bots(self):
-
-        bots = []
-
-        for bot in self.bot_data:
-            if (
-                re.search(self.bot_name, bot["name"])
-                and not bot["is_enabled"]
-                and bot["active_deals_count"] > 0
-            ):
-                bots.append(bot)
+        bots = self.index_bots()["disabled_active"]
 
         self.logging.debug("Disabled single bots with active deals: " + str(len(bots)))
 
         return len(bots), bots
 
     def count_enabled_bots(self):
-
-        bots = []
-
-        for bot in self.bot_data:
-            if re.search(self.bot_name, bot["name"]) and bot["is_enabled"]:
-                bots.append(bot)
+        bots = self.index_bots()["enabled"]
 
         self.logging.debug("Enabled single bots: " + str(len(bots)))
 
         return len(bots), bots
 
     def count_all_bots(self):
-
-        bots = []
-
-        for bot in self.bot_data:
-            if re.search(self.bot_name, bot["name"]):
-                bots.append(bot)
+        bots = self.index_bots()["all"]
 
         self.logging.debug("All single bots: " + str(len(bots)))
 
@@ -109,20 +115,7 @@ class SingleBot:
         mstc = self.attributes.get("mstc", "", dca_conf)
         maxbots = self.attributes.get("single_count", "", dca_conf)
 
-        fundsneeded = bo + so
-        amount = so
-        pd = sos
-        cum_size_base = bo + so / (1 - (1 * sos / 100))
-        for i in range(mstc - 1):
-            amount = amount * os
-            fundsneeded += amount
-            pd = (pd * ss) + sos
-            price = (100 - pd) / 100
-            size_base = amount / price
-            cum_size_base += size_base
-            avg_price = fundsneeded / cum_size_base
-            required_price = avg_price * tp / 100 + avg_price
-            required_change = ((required_price / price) - 1) * 100
+        fundsneeded, pd, required_change = funds_needed(self.attributes, dca_conf)
 
         self.logging.info(
             "Using DCA settings ["
@@ -236,16 +229,10 @@ class SingleBot:
             True,
         )
 
-        for bot in bots_with_active_deals:
-            error, data = self.p3cw.request(
-                entity="deals",
-                action="",
-                action_id="",
-                additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
-                payload={"limit": 100, "bot_id": bot["id"]},
-            )
-            # sometimes API request error, instead report bot data with less details
-            if error:
+        deals = self.asyncState.deal_tracker
+        if not deals.updated_at:
+            # deals not polled yet, instead report bot data with less details
+            for bot in bots_with_active_deals:
                 self.logging.info(
                     "Open deal "
                     + bot["pairs"][0]
@@ -260,44 +247,33 @@ class SingleBot:
                         bot["active_deals_usd_profit"], "USD", locale="en_US"
                     )
                 )
-            else:
-                for deals in data:
-                    if not deals["finished?"]:
-                        if (
-                            deals["bought_volume"] == None
-                        ):  # if no bought_volume, then use base_order_volume for bought_volume
-                            bought_volume = format_currency(
-                                deals["base_order_volume"], "USD", locale="en_US"
-                            )
-                        else:
-                            bought_volume = format_currency(
-                                deals["bought_volume"], "USD", locale="en_US"
-                            )
-
-                        self.logging.info(
-                            "Open deal "
-                            + deals["pair"]
-                            + " since "
-                            + format_timedelta(
-                                datetime.utcnow()
-                                - datetime.strptime(
-                                    deals["created_at"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                                ),
-                                locale="en_US",
-                            )
-                            + " - actual profit: "
-                            + format_currency(
-                                deals["actual_usd_profit"], "USD", locale="en_US"
-                            )
-                            + " ("
-                            + deals["actual_profit_percentage"]
-                            + "%)"
-                            + " - bought volume: "
-                            + bought_volume
-                            + " - deal error: "
-                            + str(deals["deal_has_error"]),
-                            True,
-                        )
+        else:
+            for deal in deals:
+                self.logging.info(
+                    "Open deal "
+                    + deal["pair"]
+                    + " since "
+                    + format_timedelta(
+                        datetime.utcnow() - deal["created_at"], locale="en_US"
+                    )
+                    + " - actual profit: "
+                    + format_currency(deal["actual_usd_profit"], "USD", locale="en_US")
+                    + " ("
+                    + deal["actual_profit_percentage"]
+                    + "%)"
+                    + " - bought volume: "
+                    + format_currency(deal["bought_volume"], "USD", locale="en_US")
+                    + " - deal error: "
+                    + str(deal["deal_has_error"]),
+                    True,
+                )
+            self.logging.info(
+                "uPNL of active deals: "
+                + format_currency(deals.upnl, "USD", locale="en_US")
+                + " - total bought volume: "
+                + format_currency(deals.bought_volume, "USD", locale="en_US"),
+                True,
+            )
 
         return
 
@@ -402,18 +378,27 @@ class SingleBot:
         return payload
 
     def update(self, bot):
-        # Update settings on an existing bot
+        # Update settings on an existing bot, skipped if identical to the last payload pushed
+        payload = self.payload(bot["pairs"][0], new_bot=False)
+        if self.asyncState.bot_payloads.unchanged(bot["id"], payload):
+            self.logging.debug(
+                "Settings of botid " + str(bot["id"]) + " unchanged, skipping update"
+            )
+            return
 
         error, data = self.p3cw.request(
             entity="bots",
             action="update",
             action_id=str(bot["id"]),
             additional_headers={"Forced-Mode": self.attributes.get("trade_mode")},
-            payload=self.payload(bot["pairs"][0], new_bot=False),
+            payload=payload,
         )
 
         if error:
             self.logging.error("function update: " + error["msg"])
+            self.asyncState.bot_payloads.forget(bot["id"])
+        else:
+            self.asyncState.bot_payloads.store(bot["id"], payload)
 
     def enable(self, bot):
 
@@ -440,14 +425,13 @@ class SingleBot:
             self.logging.error("function enable: " + error["msg"])
         else:
             self.asyncState.bot_active = True
-            i = 0
-            for bot in self.bot_data:
-                if bot["name"] == data["name"]:
-                    self.bot_data[i]["is_enabled"] = True
-                    break
-                i += 1
+            bot = self.index_bots()["by_name"].get(data["name"])
+            if bot:
+                bot["is_enabled"] = True
+                self.bot_index = None
 
     def disable(self, bots, allbots=False):
+        # False if a bot could not be disabled
         botname = (
             self.attributes.get("prefix", "3CQSBOT", "dcabot")
             + "_"
@@ -458,6 +442,7 @@ class SingleBot:
 
         # Disable all bots
         error = {}
+        disabled = True
 
         if allbots:
             self.asyncState.bot_active = False
@@ -485,6 +470,7 @@ class SingleBot:
 
                     if error:
                         self.logging.error("function disable: " + error["msg"])
+                        disabled = False
         else:
             # Disables an existing bot
             self.logging.info(
@@ -501,6 +487,9 @@ class SingleBot:
 
             if error:
                 self.logging.error("function disable: " + error["msg"])
+                disabled = False
+
+        return disabled
 
     def create(self):
         # Creates a single bot with start signal
@@ -525,6 +514,10 @@ class SingleBot:
         else:
             # Insert new bot at the begin of all bot data
             self.bot_data.insert(0, data)
+            self.asyncState.bot_payloads.store(
+                data["id"], self.payload(self.tg_data["pair"], new_bot=False)
+            )
+            self.bot_index = None
             # Fix - 3commas needs some time for bot creation
             time.sleep(2)
             self.enable(data)
@@ -544,6 +537,8 @@ class SingleBot:
 
             if error:
                 self.logging.error("function delete: " + error["msg"])
+            else:
+                self.asyncState.bot_payloads.forget(bot["id"])
         # Only perform the disable request if necessary
         elif bot["is_enabled"]:
             self.logging.info(
@@ -582,10 +577,9 @@ class SingleBot:
 
         if self.bot_data:
 
-            for bot in self.bot_data:
-                if botname == bot["name"]:
-                    new_bot = False
-                    break
+            bot = self.index_bots()["by_name"].get(botname)
+            if bot:
+                new_bot = False
 
             if new_bot:
                 if self.tg_data["action"] == "START":
@@ -594,7 +588,7 @@ class SingleBot:
                     ):
 
                         if self.attributes.get("topcoin_filter", False):
-                            pair = self.signal.topcoin(
+                            pair, pair_volume = self.signal.topcoin(
                                 pair,
                                 self.attributes.get(
                                     "topcoin_limit", 3500, self.asyncState.dca_conf
@@ -605,6 +599,7 @@ class SingleBot:
                                 self.attributes.get("topcoin_exchange", "binance"),
                                 self.attributes.get("market"),
                                 self.asyncState.first_topcoin_call,
+                                table=self.asyncState.topcoin_table,
                             )
                             self.asyncState.first_topcoin_call = False
                         else:
@@ -0,0 +1,230 @@
+import json
+from datetime import datetime
+
+from dealtracker import DealTracker
+from pairlist import PairList
+from payloadcache import PayloadCache
+from signals import TopcoinTable
+
+
+class SharedState:
+    """Attributes shared by the coroutines and bot classes of 3cqsbot.
+
+    Callbacks registered with subscribe() are called with name, old and new
+    value whenever one of their attributes is assigned a different value, so
+    coroutines can react to a change right away instead of polling for it.
+    update() assigns several attributes and calls the subscribers only after
+    all of them are set, so they never see half of a change.
+    """
+
+    __slots__ = ("_subscribers", "_changes")
+
+    def __init__(self):
+        object.__setattr__(self, "_subscribers", {})
+        object.__setattr__(self, "_changes", None)
+
+    def __setattr__(self, name, value):
+        callbacks = self._subscribers.get(name)
+        if not callbacks:
+            object.__setattr__(self, name, value)
+            return
+
+        old = getattr(self, name, None)
+        object.__setattr__(self, name, value)
+        if old != value:
+            if self._changes is None:
+                for callback in callbacks:
+                    callback(name, old, value)
+            else:
+                self._changes.append((name, old, value))
+
+    def subscribe(self, names, callback):
+        for name in names:
+            if name not in self.fields():
+                raise AttributeError(name)
+            self._subscribers.setdefault(name, []).append(callback)
+
+    def unsubscribe(self, names, callback):
+        for name in names:
+            if callback in self._subscribers.get(name, []):
+                self._subscribers[name].remove(callback)
+
+    def update(self, **values):
+        for name in values:
+            if name not in self.fields():
+                raise AttributeError(name)
+
+        object.__setattr__(self, "_changes", [])
+        try:
+            for name, value in values.items():
+                setattr(self, name, value)
+        finally:
+            changes = self._changes
+            object.__setattr__(self, "_changes", None)
+        for name, old, value in changes:
+            for callback in self._subscribers.get(name, []):
+                callback(name, old, value)
+
+    @classmethod
+    def fields(cls):
+        names = []
+        for klass in reversed(cls.__mro__):
+            if klass is not SharedState:
+                names.extend(getattr(klass, "__slots__", ()))
+        return names
+
+    def snapshot(self):
+        # Shallow copy of all fields, containers are copied as well
+        state = {}
+        for name in self.fields():
+            value = getattr(self, name)
+            if isinstance(value, (dict, list, set)):
+                value = value.copy()
+            state[name] = value
+        return state
+
+    def serialize(self):
+        # JSON of the plain data fields, runtime objects like tasks are left out
+        state = {}
+        for name, value in self.snapshot().items():
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, (set, frozenset)):
+                value = sorted(value)
+            elif value is not None and not isinstance(
+                value, (bool, int, float, str, list, dict)
+            ):
+                continue
+            state[name] = value
+        return json.dumps(state, default=str)
+
+
+class BotState(SharedState):
+    """State of one 3cqsbot, every field is initialised here."""
+
+    __slots__ = (
+        # market regime
+        "bot_active",
+        "btc_downtrend",
+        "first_topcoin_call",
+        "fgi",
+        "fgi_downtrend",
+        "fgi_drop",
+        "fgi_allows_trading",
+        "fgi_time_until_update",
+        "dca_conf",
+        # 3Commas and Telegram
+        "chatid",
+        "chatroom",
+        "fh",
+        "account_data",
+        "pair_data",
+        "symrank_success",
+        "symrank_retry",
+        "symrank_reply",
+        "symrank_task",
+        "multibot",
+        "pairs_volume",
+        "bot_payloads",
+        "topcoin_table",
+        "deal_tracker",
+        # bot updates and deals waiting for the update window
+        "pending_updates",
+        "pending_deals",
+        "pending_report",
+        "update_flush",
+        # signal delivery
+        "lease",
+        "signal_queue",
+        "pending_signals",
+        "last_message_id",
+        "catching_up",
+        "deferred_events",
+        "receive_signals",
+        "latest_signal_time",
+        # startup
+        "ready",
+        "start_time",
+        "first_signal_time",
+        # statistics
+        "start_signals_24h",
+        "start_signals",
+        "start_signals_bot_enabled_24h",
+        "start_signals_bot_enabled",
+        "start_signals_not_tradeable_24h",
+        "start_signals_not_tradeable",
+        "start_signals_symrank_filter_passed_24h",
+        "start_signals_symrank_filter_passed",
+        "start_signals_topcoin_filter_passed_24h",
+        "start_signals_topcoin_filter_passed",
+        "stop_signals_24h",
+        "stop_signals",
+        "bot_updates_saved_24h",
+        "bot_updates_saved",
+        "fast_path_deals_24h",
+        "fast_path_deals",
+    )
+
+    def __init__(self):
+        super().__init__()
+        self.bot_active: bool = True
+        self.btc_downtrend: bool = False
+        self.first_topcoin_call: bool = True
+        self.fgi: int = -1
+        self.fgi_downtrend: bool = False
+        self.fgi_drop: bool = False
+        self.fgi_allows_trading: bool = True
+        self.fgi_time_until_update: int = 1
+        self.dca_conf: str = "dcabot"
+
+        self.chatid = ""
+        self.chatroom = None
+        self.fh = 0
+        self.account_data: dict = {}
+        self.pair_data: frozenset = frozenset()
+        self.symrank_success: bool = False
+        self.symrank_retry: int = 60
+        self.symrank_reply = None
+        self.symrank_task = None
+        self.multibot: dict = {}
+        self.pairs_volume = PairList()
+        self.bot_payloads = PayloadCache()
+        self.topcoin_table = TopcoinTable()
+        self.deal_tracker = DealTracker()
+
+        self.pending_updates: int = 0
+        self.pending_deals: list = []
+        self.pending_report = None
+        self.update_flush = None
+
+        self.lease = None
+        self.signal_queue = None
+        self.pending_signals: list = []
+        self.last_message_id: int = 0
+        self.catching_up: bool = False
+        self.deferred_events: list = []
+        # start processing 3cqs signals after async routines are working
+        self.receive_signals: bool = False
+        self.latest_signal_time = None
+
+        # readiness events of the startup steps by name
+        self.ready: dict = {}
+        self.start_time = 0
+        self.first_signal_time = None
+
+        self.start_signals_24h: int = 0
+        self.start_signals: int = 0
+        self.start_signals_bot_enabled_24h: int = 0
+        self.start_signals_bot_enabled: int = 0
+        self.start_signals_not_tradeable_24h: int = 0
+        self.start_signals_not_tradeable: int = 0
+        self.start_signals_symrank_filter_passed_24h: int = 0
+        self.start_signals_symrank_filter_passed: int = 0
+        self.start_signals_topcoin_filter_passed_24h: int = 0
+        self.start_signals_topcoin_filter_passed: int = 0
+        self.stop_signals_24h: int = 0
+        self.stop_signals: int = 0
+        self.bot_updates_saved_24h: int = 0
+        self.bot_updates_saved: int = 0
+        self.fast_path_deals_24h: int = 0
+        self.fast_path_deals: int = 0
@@ -0,0 +1,117 @@
+"""Start and watch one 3cqsbot process per data directory.
+
+Every bot runs with its data directory as working directory, so config,
+logs, lock and Telegram session file stay apart. A bot that exits is
+restarted after a delay doubling up to max_delay, the delay is reset once
+a bot has been running for stable_time.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from logger import Logger, NotificationHandler
+
+SCRIPT = Path(__file__).with_name("3cqsbot.py")
+
+parser = argparse.ArgumentParser(description="Run one 3CQSBot per data directory")
+parser.add_argument(
+    "datadirs", nargs="+", help="data directories, one per bot configuration"
+)
+parser.add_argument(
+    "--min-delay", help="first restart delay in seconds", type=int, default=10
+)
+parser.add_argument(
+    "--max-delay", help="maximum restart delay in seconds", type=int, default=600
+)
+parser.add_argument(
+    "--stable-time",
+    help="runtime in seconds after which a bot counts as stable again",
+    type=int,
+    default=600,
+)
+args = parser.parse_args()
+
+datadirs = [os.path.realpath(datadir) for datadir in args.datadirs]
+if len(set(datadirs)) != len(datadirs):
+    sys.exit("Each data directory can only be used by one bot")
+
+program = Path(__file__).stem
+notification = NotificationHandler(program)
+logging = Logger(os.getcwd(), program, notification, 7, False, False)
+
+bots = {
+    datadir: {"process": None, "started": 0, "restart_at": 0, "delay": args.min_delay}
+    for datadir in datadirs
+}
+stopping = False
+
+
+def start(datadir):
+    bot = bots[datadir]
+    bot["process"] = subprocess.Popen(
+        [sys.executable, "-u", str(SCRIPT), "--datadir", datadir], cwd=datadir
+    )
+    bot["started"] = time.monotonic()
+    logging.info(
+        "Started 3cqsbot for " + datadir + " (pid: " + str(bot["process"].pid) + ")"
+    )
+
+
+def check(datadir):
+    bot = bots[datadir]
+    if bot["process"] is None:
+        if time.monotonic() >= bot["restart_at"]:
+            start(datadir)
+        return
+
+    returncode = bot["process"].poll()
+    if returncode is None:
+        return
+
+    runtime = time.monotonic() - bot["started"]
+    if runtime >= args.stable_time:
+        bot["delay"] = args.min_delay
+    bot["process"] = None
+    bot["restart_at"] = time.monotonic() + bot["delay"]
+    logging.error(
+        "3cqsbot for "
+        + datadir
+        + " exited with code "
+        + str(returncode)
+        + " after "
+        + str(round(runtime))
+        + "s - restarting in "
+        + str(bot["delay"])
+        + "s"
+    )
+    bot["delay"] = min(bot["delay"] * 2, args.max_delay)
+
+
+def stop(signum, frame):
+    global stopping
+    stopping = True
+
+
+signal.signal(signal.SIGINT, stop)
+signal.signal(signal.SIGTERM, stop)
+
+logging.info("Supervising " + str(len(bots)) + " bots")
+while not stopping:
+    for datadir in bots:
+        check(datadir)
+    time.sleep(1)
+
+logging.info("Stopping all bots")
+running = [bot["process"] for bot in bots.values() if bot["process"]]
+for process in running:
+    process.terminate()
+deadline = time.monotonic() + 30
+for process in running:
+    try:
+        process.wait(max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        process.kill()
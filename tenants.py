@@ -0,0 +1,160 @@
+"""Run the 3cqsbot configurations of several data directories in one process.
+
+Each data directory holds the config.ini of one bot with its own account,
+market and DCA settings. The bots share one Telegram session, which receives
+every 3CQS message once and hands it to the handlers of all bots, and the
+cached market data of CoinGecko, the fear and greed index and yfinance.
+A bot stopping with sys.exit only removes its own handlers and tasks.
+"""
+import argparse
+import asyncio
+import contextvars
+import os
+import sys
+import types
+from pathlib import Path
+
+
+from config import Config
+from logger import Logger, NotificationHandler
+from tgclient import CatchUpClient
+
+SCRIPT = Path(__file__).with_name("3cqsbot.py")
+
+# Bot whose coroutine is running, inherited by the tasks it creates
+CURRENT_TENANT = contextvars.ContextVar("tenant", default=None)
+
+
+def load_tenant(datadir, name, client):
+    # Every bot runs 3cqsbot.py in its own module, so config, 3commas client
+    # and state stay separate while the Telegram client is shared
+    tenant = types.ModuleType(name)
+    tenant.__file__ = str(SCRIPT)
+    tenant.TENANT = {"datadir": datadir, "name": name, "client": client, "tasks": set()}
+    handlers = client.list_event_handlers()
+    reconnect_callbacks = list(client.reconnect_callbacks)
+    exec(compile(SCRIPT.read_text(), str(SCRIPT), "exec"), tenant.__dict__)
+
+    # The Telegram handlers of the bot stop the bot instead of the process on sys.exit
+    tenant.TENANT["handlers"] = []
+    for callback, event in client.list_event_handlers():
+        if (callback, event) not in handlers:
+            client.remove_event_handler(callback, event)
+            handler = tenant_handler(tenant, callback)
+            client.add_event_handler(handler, event)
+            tenant.TENANT["handlers"].append(handler)
+    tenant.TENANT["reconnect_callbacks"] = []
+    for callback in list(client.reconnect_callbacks):
+        if callback not in reconnect_callbacks:
+            client.remove_reconnect_callback(callback)
+            handler = client.on_reconnect(tenant_handler(tenant, callback))
+            tenant.TENANT["reconnect_callbacks"].append(handler)
+    return tenant
+
+
+def tenant_handler(tenant, callback):
+    async def handler(*args):
+        token = CURRENT_TENANT.set(tenant)
+        try:
+            await callback(*args)
+        except SystemExit as err:
+            stop_tenant(tenant, err)
+        finally:
+            CURRENT_TENANT.reset(token)
+
+    return handler
+
+
+async def tenant_coroutine(tenant, coro):
+    try:
+        return await coro
+    except SystemExit as err:
+        stop_tenant(tenant, err)
+
+
+def task_factory(loop, coro):
+    # Tasks of a bot end with the bot, its sys.exit does not stop the loop
+    tenant = CURRENT_TENANT.get()
+    if tenant is None:
+        return asyncio.Task(coro, loop=loop)
+    task = asyncio.Task(tenant_coroutine(tenant, coro), loop=loop)
+    tenant.TENANT["tasks"].add(task)
+    task.add_done_callback(tenant.TENANT["tasks"].discard)
+    return task
+
+
+def stop_tenant(tenant, err):
+    # A bot exiting only removes its own handlers and tasks, the others keep running
+    logging.error("Bot " + tenant.TENANT["name"] + " stopped: " + str(err), True)
+    for handler in tenant.TENANT["handlers"]:
+        client.remove_event_handler(handler)
+    tenant.TENANT["handlers"] = []
+    for handler in tenant.TENANT["reconnect_callbacks"]:
+        client.remove_reconnect_callback(handler)
+    tenant.TENANT["reconnect_callbacks"] = []
+    current = asyncio.current_task()
+    for task in list(tenant.TENANT["tasks"]):
+        if task is not current:
+            task.cancel()
+    if tenant.asyncState.lease and tenant.asyncState.lease.held():
+        tenant.asyncState.lease.release()
+    notification.send_notification()
+
+
+def tenant_names(datadirs):
+    names = []
+    for datadir in datadirs:
+        name = os.path.basename(os.path.realpath(datadir))
+        if name in names:
+            name += "_" + str(len(names) + 1)
+        names.append(name)
+    return names
+
+
+async def start(tenant):
+    CURRENT_TENANT.set(tenant)
+    await tenant_coroutine(tenant, tenant.main())
+
+
+async def run(tenants):
+    asyncio.get_running_loop().set_task_factory(task_factory)
+    await asyncio.gather(*(start(tenant) for tenant in tenants))
+
+
+parser = argparse.ArgumentParser(
+    description="Run several 3CQSBot configurations sharing one Telegram client"
+)
+parser.add_argument(
+    "datadirs", nargs="+", help="data directories, one per bot configuration"
+)
+args = parser.parse_args()
+
+datadirs = [os.path.realpath(datadir) for datadir in args.datadirs]
+if len(set(datadirs)) != len(datadirs):
+    sys.exit("Each data directory can only be used by one bot")
+
+# Telegram session and API credentials of the first configuration are used
+attributes = Config(datadirs[0], SCRIPT.stem)
+notification = NotificationHandler(Path(__file__).stem)
+logging = Logger(os.getcwd(), Path(__file__).stem, notification, 7, False, False)
+
+client = CatchUpClient(
+    attributes.get("sessionfile", "tgsesssion"),
+    attributes.get("api_id"),
+    attributes.get("api_hash"),
+)
+
+tenants = [
+    load_tenant(datadir, name, client)
+    for datadir, name in zip(datadirs, tenant_names(datadirs))
+]
+logging.info(
+    "Running " + str(len(tenants)) + " bots: " + ", ".join(tenant_names(datadirs))
+)
+
+try:
+    client.start()
+    client.loop.run_until_complete(run(tenants))
+    client.run_until_disconnected()
+except Exception as err:
+    logging.error(f"Exception raised by Telegram client: {err}")
@@ -0,0 +1,29 @@
+from telethon import TelegramClient
+
+
+class CatchUpClient(TelegramClient):
+    """TelegramClient notifying the bots after Telethon reconnected on its own.
+
+    Coroutines registered with on_reconnect() are started after every
+    automatic reconnect, so the messages missed meanwhile can be fetched
+    right away instead of waiting for the next message or a polling task.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.reconnect_callbacks = []
+        super().__init__(*args, **kwargs)
+
+    def on_reconnect(self, callback):
+        # usable as decorator like TelegramClient.on()
+        self.reconnect_callbacks.append(callback)
+        return callback
+
+    def remove_reconnect_callback(self, callback):
+        if callback in self.reconnect_callbacks:
+            self.reconnect_callbacks.remove(callback)
+
+    async def _handle_auto_reconnect(self):
+        # called by the Telethon sender once the connection is back
+        for callback in list(self.reconnect_callbacks):
+            self.loop.create_task(callback())
+        await super()._handle_auto_reconnect()